@@ -5,10 +5,16 @@ Improved ROHub RO-Crate resource listing based on ROHub API documentation
 
 import re
 import os
-import rohub
-import pandas as pd
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
 from typing import List, Dict, Any, Optional
 
+from download_cache import ROCrateCache, verify_file
+from instrumentation import instrumented, span
+
 class ROHubIDExtractor:
     """Extract ROHub IDs from various URL formats."""
 
@@ -59,31 +65,178 @@ class ROHubIDExtractor:
         return None
 
 class ROHubROCrateSearcher:
-    """ROHub searcher using ROHub API methods."""
+    """
+    ROHub searcher using ROHub API methods.
+
+    The rohub package keeps its access token in module-level state, so the
+    login is shared by every searcher of the process: it happens lazily on
+    first use, once, and again only when the token has expired. A searcher
+    can be used from several threads at once.
+    """
+
+    # Assumed token lifetime when rohub does not report one, in seconds
+    TOKEN_LIFETIME = 300
+    # Log in again this many seconds before the token expires
+    TOKEN_MARGIN = 30
+    # After a failed login, use public access this many seconds before retrying
+    LOGIN_RETRY_DELAY = 60
+
+    _auth_lock = threading.Lock()
+    _auth_user = None
+    _auth_valid_until = 0.0
+    _auth_failed_user = None
+    _auth_failed_until = 0.0
     
-    def __init__(self):
+    def __init__(self, username: str = None, password: str = None):
         self.name = "ROHub"
+        self.username = username
+        self.password = password
+
+    @classmethod
+    def _token_valid_until(cls) -> float:
+        """Expiry of the current rohub access token as a timestamp."""
+        import rohub
+        valid_to = getattr(getattr(rohub, 'settings', None), 'ACCESS_TOKEN_VALID_TO', None)
+        if isinstance(valid_to, datetime):
+            return valid_to.timestamp()
+        if isinstance(valid_to, (int, float)):
+            return float(valid_to)
+        return time.time() + cls.TOKEN_LIFETIME
+
+    def ensure_authenticated(self) -> bool:
+        """
+        Log in to ROHub unless this process already holds a valid token for the user.
+
+        A failed login is not raised: it is reported once, and the caller goes
+        on with public access. It is retried only after LOGIN_RETRY_DELAY
+        seconds, so concurrent downloads do not each attempt it again.
+
+        Returns:
+            True if authenticated, False if using public access
+        """
+        if not (self.username and self.password):
+            return False
+        cls = ROHubROCrateSearcher
+        with cls._auth_lock:
+            now = time.time()
+            if cls._auth_user == self.username and now < cls._auth_valid_until - cls.TOKEN_MARGIN:
+                return True
+            if cls._auth_failed_user == self.username and now < cls._auth_failed_until:
+                return False
+            try:
+                import rohub
+                rohub.login(username=self.username, password=self.password)
+            except Exception as e:
+                cls._auth_failed_user = self.username
+                cls._auth_failed_until = now + cls.LOGIN_RETRY_DELAY
+                print(f"Warning: ROHub authentication failed: {e}")
+                print("Note: Only public ROs will be accessible.")
+                return False
+            cls._auth_failed_user = None
+            cls._auth_user = self.username
+            cls._auth_valid_until = self._token_valid_until()
+            print("✓ Successfully authenticated with ROHub")
+            return True
     
     def authenticate_rohub(self, username: str = None, password: str = None):
         """Authenticate with ROHub if credentials are provided."""
         try:
             if username and password:
-                rohub.login(username=username, password=password)
-                print("✓ Successfully authenticated with ROHub")
+                self.username = username
+                self.password = password
+            if self.username and self.password:
+                self.ensure_authenticated()
             else:
                 print("Note: No ROHub credentials provided. Only public ROs will be accessible.")
         except Exception as e:
             print(f"Warning: ROHub authentication failed: {e}")
     
-    def download_rocrate(self, rohub_id: str, output_dir: str):
-        """Download a RO-Crate using ROHub API."""
+    def ro_version(self, rohub_id: str) -> Optional[str]:
+        """Modification date of a research object, or None if it cannot be determined."""
+        try:
+            import rohub
+            self.ensure_authenticated()
+            ro = rohub.ros_load(identifier=rohub_id)
+            modified = getattr(ro, 'modified_on', None)
+            return str(modified) if modified else None
+        except Exception as e:
+            print(f"Note: could not check the version of {rohub_id}: {e}")
+            return None
+    
+    @instrumented("rohub.download")
+    def download_rocrate(self, rohub_id: str, output_dir: str, cache: ROCrateCache = None,
+                         offline: bool = False) -> Optional[str]:
+        """
+        Download a RO-Crate using ROHub API.
+
+        With a cache, a verified copy of the research object that is still
+        current (same modification date on ROHub) is reused instead of
+        exporting it again, and new exports are verified and added to it.
+        A copy whose date was checked less than cache.max_age seconds ago is
+        reused without contacting ROHub at all. When the date cannot be read,
+        the research object is exported again; the cached copy is then only
+        used, with a warning, if the export fails.
+
+        Args:
+            rohub_id: ROHub research object id
+            output_dir: Directory receiving <rohub_id>.zip
+            cache: Optional ROCrateCache
+            offline: Do not contact ROHub: any verified cached copy is used
+                     and nothing is exported when there is none
+
+        Returns:
+            Path of the RO-Crate ZIP, or None on failure
+        """
+        target = os.path.join(output_dir, rohub_id + ".zip")
+        unverified = None
         try:
+            version = None
+            if cache:
+                # A copy checked recently is used without logging in to ROHub
+                cached = cache.lookup(rohub_id) if offline else cache.recent(rohub_id)
+                if not cached and not offline:
+                    version = self.ro_version(rohub_id)
+                    if version is None:
+                        # The cached copy may be stale: export again, and only
+                        # fall back to it if the export fails
+                        unverified = cache.lookup(rohub_id)
+                    else:
+                        cached = cache.lookup(rohub_id, version)
+                if cached:
+                    cache.materialize(cached, target)
+                    print(f"✓ RO-Crate {rohub_id} is up to date, using cached copy")
+                    return target
+            if offline:
+                print(f"✗ RO-Crate {rohub_id} is not cached (offline mode)")
+                return None
+            
+            import rohub
+            self.ensure_authenticated()
             print(f"Loading research object: {rohub_id}")
-            ro = rohub.ros_export_to_rocrate(identifier=rohub_id, filename = output_dir + "/" + rohub_id, use_format="zip")
+            os.makedirs(output_dir, exist_ok=True)
+            # Export into a staging directory so a partial export never replaces a good crate
+            staging_dir = tempfile.mkdtemp(prefix=f".{rohub_id}.", dir=output_dir)
+            try:
+                with span("rohub.export", rohub_id=rohub_id) as stage:
+                    rohub.ros_export_to_rocrate(identifier=rohub_id, filename=os.path.join(staging_dir, rohub_id), use_format="zip")
+                    exported = os.path.join(staging_dir, os.listdir(staging_dir)[0])
+                    stage.add_bytes(os.path.getsize(exported))
+                if cache:
+                    cache.materialize(cache.store(rohub_id, exported, version), target)
+                else:
+                    verify_file(exported, is_zip=True, test_members=True)
+                    os.replace(exported, target)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
             print(f"✓ Successfully loaded RO: {rohub_id}")
-            return ro
+            return target
         except Exception as e:
             print(f"✗ Error loading research object {rohub_id}: {e}")
+            if unverified:
+                cache.materialize(unverified, target)
+                print(f"⚠ Using the cached copy of RO-Crate {rohub_id}, which could not be checked "
+                      "against ROHub and may be outdated")
+                return target
             return None
     
 def demonstrate_usage():
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks of Galaxy RO-Crate parsing at growing crate sizes
+Generates synthetic Galaxy invocation RO-Crates with N datasets, M workflow
+steps and K parameters (invocation_attrs.txt, datasets_attrs.txt,
+jobs_attrs.txt, ro-crate-metadata.json, workflow and job file laid out like a
+Galaxy export), then times and memory-profiles each parsing stage of
+prepare_inputs_and_parameters.py and extract_md_from_galaxy_rocrate.py on
+them. Results are appended to a JSON lines file and compared with the
+previous run at the same scale, so regressions show up. Nothing touches the
+network.
+
+    python benchmark_crates.py --scales 100x10x10 1000x50x50 10000x200x200
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+import zipfile
+from datetime import datetime, timedelta, timezone
+
+from extract_md_from_galaxy_rocrate import render_markdown
+from galaxy_rocrate import DATASET_KEYS, load_galaxy_crate, open_galaxy_crate, read_invocation
+from prepare_inputs_and_parameters import find_crate_files, get_datasets_info, prepare_rocrate
+from streaming_json import stream_datasets
+
+DEFAULT_SCALES = ["100x10x10", "1000x50x50", "10000x200x200"]
+DEFAULT_RESULTS = "benchmark_results.jsonl"
+DEFAULT_REPEATS = 5
+# Slowdown of the fastest run, relative to the previous run, reported as a regression
+REGRESSION_THRESHOLD = 1.25
+
+
+def parse_scale(scale):
+    """'NxMxK' -> (datasets, steps, parameters)"""
+    datasets, steps, parameters = (int(part) for part in scale.lower().split('x'))
+    if datasets < steps + 1:
+        raise ValueError(f"Scale {scale}: needs at least one dataset per step plus the input dataset")
+    return datasets, steps, parameters
+
+
+def _encoded_id(rng):
+    return f"{rng.getrandbits(64):016x}"
+
+
+def _dataset_record(rng, encoded_id, hid, file_name, extension, create_time):
+    """A datasets_attrs.txt record with the members Galaxy exports."""
+    return {
+        "model_class": "HistoryDatasetAssociation",
+        "encoded_id": encoded_id,
+        "id": hid,
+        "hid": hid,
+        "name": f"dataset {hid}",
+        "info": "uploaded tabular file" if extension == "tabular" else "",
+        "blurb": f"{rng.randint(10, 100000)} lines",
+        "peek": "<table><tr><td>year</td><td>T</td></tr>" + "".join(
+            f"<tr><td>{1950 + row}</td><td>{rng.uniform(-2, 2):.2f}</td></tr>" for row in range(5)) + "</table>",
+        "extension": extension,
+        "metadata": {"dbkey": "?", "data_lines": rng.randint(10, 100000), "comment_lines": 1,
+                     "columns": 2, "column_types": ["int", "float"], "column_names": ["year", "T"],
+                     "delimiter": "\t"},
+        "designation": None,
+        "deleted": False,
+        "visible": True,
+        "create_time": create_time,
+        "update_time": create_time,
+        "state": "ok",
+        "file_name": file_name,
+        "extra_files_path": f"{file_name[:-len(extension) - 1]}_files",
+        "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+        "annotation": None,
+        "tags": [],
+        "hashes": [{"model_class": "DatasetHash", "hash_function": "SHA-256",
+                    "hash_value": f"{rng.getrandbits(256):064x}", "extra_files_path": None}],
+        "sources": [],
+        "file_size": rng.randint(100, 10_000_000),
+    }
+
+
+def make_synthetic_crate(path, datasets=100, steps=10, parameters=10, dataset_bytes=256, seed=0):
+    """
+    Write a synthetic Galaxy invocation RO-Crate ZIP.
+
+    Dataset 0 is the workflow input, the last steps datasets are the step
+    outputs and the others are intermediate history datasets. The K
+    parameters are spread over the tool steps and are also workflow
+    parameter inputs of the job file.
+
+    Args:
+        path: ZIP file to write
+        datasets: Number of datasets (N)
+        steps: Number of tool steps (M)
+        parameters: Number of tool parameters (K)
+        dataset_bytes: Size of each dataset file
+        seed: Random seed (the same arguments always give the same crate)
+
+    Returns:
+        path
+    """
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def timestamp(seconds):
+        return (start + timedelta(seconds=seconds)).isoformat()
+
+    # Datasets: 0 is the input, the last `steps` ones are step outputs
+    dataset_records = []
+    for number in range(datasets):
+        is_output = number >= datasets - steps
+        extension = "png" if is_output else "tabular"
+        encoded_id = _encoded_id(rng)
+        file_name = f"datasets/dataset_{uuid.UUID(int=rng.getrandbits(128))}.{extension}"
+        dataset_records.append(_dataset_record(rng, encoded_id, number + 1, file_name, extension, timestamp(number)))
+    input_record = dataset_records[0]
+    output_records = dataset_records[datasets - steps:]
+
+    parameter_names = [f"param_{number}" for number in range(parameters)]
+
+    def parameter_value(number):
+        # Galaxy quotes scalars and JSON-encodes nested sections
+        if number % 3 == 0:
+            return json.dumps({"colormap": rng.choice(["RdBu_r", "Blues", "viridis"]), "nxsplit": number})
+        return json.dumps(f"value {number}")
+
+    step_states = []
+    invocation_steps = []
+    jobs = []
+    for step in range(1, steps + 1):
+        step_parameters = {name: parameter_value(number) for number, name in enumerate(parameter_names)
+                           if number % steps == step - 1}
+        step_parameters.update({"__page__": 0, "__rerun_remap_job_id__": None, "chromInfo": "\"?\"", "dbkey": "\"?\""})
+        step_states.append({"order_index": step, "value": step_parameters})
+        job_id = _encoded_id(rng)
+        output_record = output_records[step - 1]
+        invocation_steps.append({
+            "model_class": "WorkflowInvocationStep",
+            "id": _encoded_id(rng),
+            "order_index": step,
+            "workflow_step_id": _encoded_id(rng),
+            "state": "scheduled",
+            "update_time": timestamp(datasets + step),
+            "job_id": job_id,
+            "action": None,
+            "jobs": [{"id": job_id, "state": "ok", "tool_id": f"toolshed.g2.bx.psu.edu/repos/climate/tool_{step}/1.0"}],
+            "outputs": {"output": {"src": "hda", "id": output_record["encoded_id"]}},
+            "output_collections": {},
+        })
+        jobs.append({
+            "model_class": "Job",
+            "encoded_id": job_id,
+            "tool_id": f"toolshed.g2.bx.psu.edu/repos/climate/tool_{step}/1.0",
+            "tool_version": "1.0",
+            "state": "ok",
+            "create_time": timestamp(datasets + step),
+            "params": {name: value for name, value in step_parameters.items() if not name.startswith("__")},
+            "command_line": f"python tool_{step}.py --input input.tabular --output output.png",
+            "input_datasets": [{"name": "input", "dataset": {"encoded_id": input_record["encoded_id"]}}],
+            "output_datasets": [{"name": "output", "dataset": {"encoded_id": output_record["encoded_id"]}}],
+            "exit_code": 0,
+            "stdout": "",
+            "stderr": "",
+        })
+
+    invocation = {
+        "model_class": "WorkflowInvocation",
+        "id": _encoded_id(rng),
+        "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+        "state": "scheduled",
+        "create_time": timestamp(0),
+        "update_time": timestamp(datasets + steps),
+        "workflow": {"name": "Synthetic climate stripes", "steps": steps},
+        "steps": invocation_steps,
+        "input_parameters": [
+            {"model_class": "WorkflowRequestInputParameter", "name": name, "value": repr(f"value {number}"),
+             "type": "step_param"}
+            for number, name in enumerate(parameter_names)],
+        "step_states": step_states,
+        "input_datasets": [{"order_index": 0, "dataset": {"encoded_id": input_record["encoded_id"]},
+                            "name": "files.tabular"}],
+        "output_datasets": [{"order_index": step, "dataset": {"encoded_id": record["encoded_id"]},
+                             "workflow_output": {"label": f"output_{step}"}}
+                            for step, record in enumerate(output_records, start=1)],
+        "input_dataset_collections": [],
+        "output_dataset_collections": [],
+        "output_values": [],
+    }
+
+    workflow = {
+        "a_galaxy_workflow": "true",
+        "format-version": "0.1",
+        "name": "Synthetic climate stripes",
+        "annotation": "",
+        "tags": [],
+        "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+        "version": 1,
+        "steps": {
+            str(step): {"id": step, "type": "tool" if step else "data_input",
+                        "label": f"output_{step}" if step else "files.tabular",
+                        "tool_id": f"toolshed.g2.bx.psu.edu/repos/climate/tool_{step}/1.0" if step else None,
+                        "tool_state": json.dumps(step_states[step - 1]["value"]) if step else "{}",
+                        "input_connections": {"input": {"id": 0, "output_name": "output"}} if step else {}}
+            for step in range(steps + 1)},
+    }
+
+    job_lines = ["- job:", "    files.tabular:", "      class: File", "      path: input.tabular",
+                 "      filetype: tabular"]
+    job_lines += [f"    {name}: value {number}" for number, name in enumerate(parameter_names)]
+    job_lines.append("  outputs:")
+    for step in range(1, steps + 1):
+        job_lines += [f"    output_{step}:", "      class: File", f"      path: output_{step}.png"]
+
+    # Format2 copy of the workflow, listed before the job file as in Galaxy exports
+    gxwf_lines = ["class: GalaxyWorkflow", "label: Synthetic climate stripes", "inputs:",
+                  "  files.tabular:", "    type: data"]
+    gxwf_lines += [f"  {name}:\n    type: string" for name in parameter_names]
+    gxwf_lines.append("steps:")
+    for step in range(1, steps + 1):
+        gxwf_lines += [f"  step_{step}:", f"    tool_id: toolshed.g2.bx.psu.edu/repos/climate/tool_{step}/1.0",
+                       "    in:", f"      input: {'files.tabular' if step == 1 else f'step_{step - 1}/output'}"]
+
+    workflow_id = "workflows/synthetic_climate_stripes.gxwf.yml"
+    graph = [
+        {"@id": "ro-crate-metadata.json", "@type": "CreativeWork", "about": {"@id": "./"},
+         "conformsTo": {"@id": "https://w3id.org/ro/crate/1.1"}},
+        {"@id": "./", "@type": "Dataset", "name": "Synthetic Galaxy invocation",
+         "mainEntity": {"@id": workflow_id},
+         "hasPart": [{"@id": record["file_name"]} for record in dataset_records] + [{"@id": workflow_id}],
+         "mentions": [{"@id": "#invocation"}]},
+        {"@id": workflow_id, "@type": ["File", "SoftwareSourceCode", "ComputationalWorkflow"],
+         "name": "Synthetic climate stripes", "programmingLanguage": {"@id": "#galaxy"},
+         "input": [{"@id": "#input-files.tabular"}] + [{"@id": f"#input-{name}"} for name in parameter_names],
+         "output": [{"@id": f"#output-{step}"} for step in range(1, steps + 1)],
+         "step": [{"@id": f"#step-{step}"} for step in range(1, steps + 1)]},
+        {"@id": "#galaxy", "@type": "ComputerLanguage", "name": "Galaxy", "url": {"@id": "https://galaxyproject.org/"}},
+        {"@id": "#input-files.tabular", "@type": "FormalParameter", "name": "files.tabular",
+         "additionalType": "File", "description": "Input table"},
+        {"@id": "#invocation", "@type": "CreateAction", "name": "Run of Synthetic climate stripes",
+         "instrument": {"@id": workflow_id}, "startTime": timestamp(0), "endTime": timestamp(datasets + steps),
+         "object": [{"@id": input_record["file_name"]}],
+         "result": [{"@id": record["file_name"]} for record in output_records]},
+    ]
+    graph += [{"@id": f"#input-{name}", "@type": "FormalParameter", "name": name, "additionalType": "Text",
+               "description": f"Parameter {name}"} for name in parameter_names]
+    graph += [{"@id": f"#output-{step}", "@type": "FormalParameter", "name": f"output_{step}",
+               "additionalType": "File"} for step in range(1, steps + 1)]
+    graph += [{"@id": f"#step-{step}", "@type": "HowToStep", "position": step,
+               "workExample": {"@id": f"toolshed.g2.bx.psu.edu/repos/climate/tool_{step}/1.0"}}
+              for step in range(1, steps + 1)]
+    graph += [{"@id": record["file_name"], "@type": "File", "name": record["name"],
+               "encodingFormat": record["extension"], "contentSize": dataset_bytes,
+               "dateCreated": record["create_time"]} for record in dataset_records]
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("ro-crate-metadata.json", json.dumps({"@context": "https://w3id.org/ro/crate/1.1/context",
+                                                                "@graph": graph}, indent=1))
+        zip_file.writestr("invocation_attrs.txt", json.dumps([invocation]))
+        zip_file.writestr("datasets_attrs.txt", json.dumps(dataset_records))
+        zip_file.writestr("jobs_attrs.txt", json.dumps(jobs))
+        zip_file.writestr("collections_attrs.txt", "[]")
+        zip_file.writestr("workflows/synthetic_climate_stripes.ga", json.dumps(workflow, indent=2))
+        zip_file.writestr(workflow_id, "\n".join(gxwf_lines) + "\n")
+        zip_file.writestr("workflows/synthetic_climate_stripes-tests.yml", "\n".join(job_lines) + "\n")
+        for number, record in enumerate(dataset_records):
+            if record["extension"] == "tabular":
+                rows = ["year\tT"] + [f"{1950 + row}\t{rng.uniform(-2, 2):.2f}" for row in range(dataset_bytes // 11)]
+                zip_file.writestr(record["file_name"], "\n".join(rows) + "\n")
+            else:
+                zip_file.writestr(record["file_name"], b"\x89PNG\r\n\x1a\n" + bytes(dataset_bytes - 8))
+    return path
+
+
+def _quiet(function):
+    """Run function with its progress output discarded."""
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function()
+    return run
+
+
+def benchmark_stages(crate_path, scratch_dir):
+    """
+    Stage name -> callable running that stage on crate_path.
+
+    The stages follow prepare_inputs_and_parameters.py (crate indexing,
+    invocation and dataset parsing, whole preparation) and
+    extract_md_from_galaxy_rocrate.py (crate loading and markdown rendering).
+    datasets.stream and datasets.json_loads read datasets_attrs.txt with the
+    streaming reader and with a single json.loads, to compare the two.
+    """
+    with open_galaxy_crate(crate_path) as crate:
+        with crate.open(crate.find("invocation_attrs.txt")[0]) as f:
+            invocation = read_invocation(f)
+
+    def crate_index():
+        with open_galaxy_crate(crate_path) as crate:
+            find_crate_files(crate)
+
+    def invocation_parse():
+        with open_galaxy_crate(crate_path) as crate, crate.open(crate.find("invocation_attrs.txt")[0]) as f:
+            read_invocation(f)
+
+    def datasets_parse():
+        with open_galaxy_crate(crate_path) as crate, crate.open(crate.find("datasets_attrs.txt")[0]) as f:
+            get_datasets_info(f, invocation['input_datasets'], invocation['output_datasets'])
+
+    def datasets_stream():
+        with open_galaxy_crate(crate_path) as crate, crate.open(crate.find("datasets_attrs.txt")[0]) as f:
+            for _ in stream_datasets(f, keys=DATASET_KEYS):
+                pass
+
+    def datasets_json_loads():
+        # Reference for datasets.stream: the whole member decoded at once
+        with open_galaxy_crate(crate_path) as crate, crate.open(crate.find("datasets_attrs.txt")[0]) as f:
+            json.loads(f.read())
+
+    runs = itertools.count()
+
+    def prepare():
+        # A fresh output directory each time: existing inputs would not be extracted again
+        output_dir = os.path.join(scratch_dir, f"prepare-{next(runs)}")
+        os.makedirs(output_dir)
+        prepare_rocrate(crate_path, output_dir, os.path.join(output_dir, "workflow_input_params.yml"),
+                        os.path.join(output_dir, "workflow.ga"))
+        shutil.rmtree(output_dir)
+
+    stages = {
+        "crate.index": crate_index,
+        "invocation.parse": invocation_parse,
+        "datasets.parse": datasets_parse,
+        "datasets.stream": datasets_stream,
+        "datasets.json_loads": datasets_json_loads,
+        "prepare.rocrate": _quiet(prepare),
+    }
+
+    workflow_info = load_galaxy_crate(crate_path)
+    stages["crate.load"] = lambda: load_galaxy_crate(crate_path)
+    stages["markdown.render"] = lambda: render_markdown(workflow_info)
+    return stages
+
+
+def measure(function, repeats=DEFAULT_REPEATS):
+    """
+    Time function over repeats runs, then measure its peak Python allocations in one more run.
+
+    Returns:
+        dict with median_s, min_s and peak_alloc_bytes
+    """
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # tracemalloc slows allocations down, so it is kept out of the timed runs
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'median_s': statistics.median(times), 'min_s': min(times), 'peak_alloc_bytes': peak}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(results_filename):
+    """(scale, stage) -> latest stored result."""
+    latest = {}
+    if os.path.exists(results_filename):
+        with open(results_filename) as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    latest[(result['scale'], result['stage'])] = result
+    return latest
+
+
+def run_benchmarks(scales, results_filename=DEFAULT_RESULTS, repeats=DEFAULT_REPEATS, work_dir=None,
+                   threshold=REGRESSION_THRESHOLD):
+    """
+    Benchmark every stage at every scale and append the results to results_filename.
+
+    Synthetic crates are generated once per scale in work_dir (a temporary
+    directory by default) and reused when work_dir is kept between runs.
+
+    Returns:
+        list: The new results, each with a 'regression' flag against the previous run
+    """
+    previous = previous_results(results_filename)
+    run = {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': _git_commit(),
+           'python': platform.python_version(), 'machine': platform.machine()}
+
+    results = []
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="benchmark-crates-"))
+        os.makedirs(work_dir, exist_ok=True)
+
+        print(f"{'scale':<16} {'stage':<18} {'median ms':>10} {'min ms':>9} {'peak MB':>8} {'vs previous':>12}")
+        for scale in scales:
+            datasets, steps, parameters = parse_scale(scale)
+            crate_path = os.path.join(work_dir, f"crate-{scale}.zip")
+            if not os.path.exists(crate_path):
+                make_synthetic_crate(crate_path, datasets, steps, parameters)
+            scratch_dir = stack.enter_context(tempfile.TemporaryDirectory(dir=work_dir))
+
+            for stage, function in benchmark_stages(crate_path, scratch_dir).items():
+                result = dict(run, scale=scale, datasets=datasets, steps=steps, parameters=parameters,
+                              crate_bytes=os.path.getsize(crate_path), stage=stage, repeats=repeats,
+                              **measure(function, repeats))
+                before = previous.get((scale, stage))
+                # The fastest run is the least noisy to compare
+                ratio = result['min_s'] / before['min_s'] if before and before['min_s'] else None
+                result['regression'] = bool(ratio and ratio > threshold)
+                mark = "" if ratio is None else f"{ratio:.2f}x" + (" ✗" if result['regression'] else " ✓")
+                print(f"{scale:<16} {stage:<18} {result['median_s'] * 1000:>10.2f} {result['min_s'] * 1000:>9.2f} "
+                      f"{result['peak_alloc_bytes'] / 1e6:>8.1f} {mark:>12}")
+                results.append(result)
+
+    with open(results_filename, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark RO-Crate parsing on synthetic Galaxy crates (offline)",
+        epilog="Example: python benchmark_crates.py --scales 100x10x10 1000x50x50 --repeats 3")
+    parser.add_argument("--scales", nargs="+", default=DEFAULT_SCALES,
+                        help="Crate sizes as DATASETSxSTEPSxPARAMETERS (default: %(default)s)")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="Timed runs per stage")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSON lines file the results are appended to")
+    parser.add_argument("--work-dir", default=None,
+                        help="Keep the generated crates in this directory (default: a temporary directory)")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Slowdown against the previous run reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on a regression")
+    parser.add_argument("--generate", metavar="ZIP", default=None,
+                        help="Only write one synthetic crate of the first scale to ZIP")
+    args = parser.parse_args()
+
+    if args.generate:
+        make_synthetic_crate(args.generate, *parse_scale(args.scales[0]))
+        print(f"✅ Synthetic crate saved to: {args.generate}")
+        sys.exit(0)
+
+    results = run_benchmarks(args.scales, args.results, args.repeats, args.work_dir, args.threshold)
+    regressions = [result for result in results if result['regression']]
+    print(f"\n{len(results)} measurements appended to {args.results}; {len(regressions)} regression(s)")
+    sys.exit(1 if regressions and args.fail_on_regression else 0)
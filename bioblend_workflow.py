@@ -28,14 +28,7 @@ import tempfile
 import pooch
 import json
 
-
-# %%
-def upload_to_history(inputs, gi, hist_hid):
-    ret_uploads = []
-    for input_filename in inputs:
-        ret = gi.tools.upload_file(input_filename, hist_id)
-        ret_uploads.append(ret)
-    return ret_uploads
+from galaxy_runner import download_invocation_archive, upload_to_history, wait_for_invocation
 
 
 # %% [markdown]
@@ -91,6 +84,7 @@ hist_id = new_hist["id"]
 hist_id
 
 # %%
+# Concurrent, chunked (TUS) uploads; files already in the history (same SHA-256) are skipped
 ret_uploads = upload_to_history(workflow_parameters["inputs"], gi, hist_id)
 
 # %% [markdown]
@@ -117,31 +111,18 @@ print(params)
 ret = gi.workflows.invoke_workflow(wf_id, inputs=inputs, params=params, history_id=hist_id)
 
 # %%
-while True:
-    history = gi.histories.show_history(hist_id, contents=True)
-    states = [dataset['state'] for dataset in history]
-    if all(state in ['ok', 'error'] for state in states):
-        print("✅ Workflow has completed.")
-        break
-    else:
-        print("⏳ Waiting for workflow to complete...")
-        time.sleep(10)
+# Polls the invocation job summary with exponential backoff; fails fast on the first job error
+summary = wait_for_invocation(gi, ret["id"], timeout=6 * 3600)
+print("✅ Workflow has completed.")
 
 # %% [markdown]
 # ## Get RO-Crate
 
-# %%
-response = gi.invocations.get_invocation_archive(
-        invocation_id = ret["id"],
-        model_store_format= "rocrate.zip")
-
 # %%
 file = "climate.rocrate.zip"
 
-with open(file, "bw") as archive:
-    for chunk in response.iter_content(chunk_size=8192):
-        archive.write(chunk)
-        # Verify file is not empty
+# Waits for Galaxy's asynchronous export, then downloads with resume and a ZIP integrity check
+download_invocation_archive(gi, ret["id"], file, model_store_format="rocrate.zip")
 
 # %% [markdown]
 # # Delete history
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped columnar cache for CSV/tabular workflow inputs
+The first read of a table parses it once and stores every column as a NumPy
+.npy file (raw strings; float values on first numeric request) in a sidecar
+cache directory. Later reads memory-map only the columns asked for, without
+parsing the text again. An entry is rebuilt when the table's size changes or
+its mtime changes together with its SHA-256, or when it is read with an explicit
+filetype other than the one it was parsed as.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from download_cache import sha256sum
+from table_reader import guess_filetype, read_columns, to_float_array
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "warming-stripes", "columns")
+
+
+class ColumnCache:
+    """
+    Sidecar column store for tables, one entry per table path.
+
+    Layout: <cache_dir>/<sha256 of the table path>/manifest.json, plus
+    <stamp>-<n>.str.npy (raw values) and <stamp>-<n>.f8.npy (floats) per
+    column n, where stamp identifies the version of the table they were built from.
+    """
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or os.environ.get("WARMING_STRIPES_COLUMN_CACHE", DEFAULT_CACHE_DIR)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Sent to worker processes by the batch renderer: locks do not pickle
+        return {'cache_dir': self.cache_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['cache_dir'])
+
+    def entry_dir(self, path: str) -> str:
+        key = hashlib.sha256(os.path.realpath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    @staticmethod
+    def _load_manifest(entry_dir: str):
+        try:
+            with open(os.path.join(entry_dir, "manifest.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_manifest(entry_dir: str, manifest: dict):
+        manifest_path = os.path.join(entry_dir, "manifest.json")
+        tmp_path = f"{manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    @staticmethod
+    def _save_array(path: str, array):
+        import numpy as np
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    def _fresh_manifest(self, path: str, entry_dir: str, filetype):
+        """
+        Return the manifest of entry_dir if it still describes path, else None.
+
+        The manifest records the filetype the table was parsed as, so a read
+        that leaves it to be guessed (filetype None) uses any entry.
+        """
+        manifest = self._load_manifest(entry_dir)
+        if manifest is None or (filetype is not None and manifest.get('filetype') != filetype):
+            return None
+        stat = os.stat(path)
+        if manifest['size'] != stat.st_size:
+            return None
+        if manifest['mtime_ns'] != stat.st_mtime_ns:
+            # Touched, copied or checked out again: only rebuild if the content changed
+            if sha256sum(path) != manifest['sha256']:
+                return None
+            manifest['mtime_ns'] = stat.st_mtime_ns
+            self._save_manifest(entry_dir, manifest)
+        return manifest
+
+    def _build(self, path: str, entry_dir: str, filetype) -> dict:
+        """Parse the whole table once and store each column's raw values."""
+        import numpy as np
+
+        stat = os.stat(path)
+        sha256 = sha256sum(path)
+        stamp = f"{stat.st_mtime_ns}-{stat.st_size}"
+        filetype = guess_filetype(path, filetype)
+        os.makedirs(entry_dir, exist_ok=True)
+
+        data = read_columns(path, None, filetype)
+        columns = {}
+        for number, (name, raw_values) in enumerate(data.items()):
+            filename = f"{stamp}-{number}.str.npy"
+            self._save_array(os.path.join(entry_dir, filename), np.asarray(raw_values, dtype=str))
+            columns[name] = {'raw': filename, 'float': None}
+
+        manifest = {'source': os.path.realpath(path), 'filetype': filetype, 'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns, 'sha256': sha256, 'stamp': stamp,
+                    'rows': len(next(iter(data.values()), [])), 'columns': columns}
+        self._save_manifest(entry_dir, manifest)
+
+        # Arrays of older versions of the table (still readable by open memory maps)
+        for filename in os.listdir(entry_dir):
+            if filename.endswith(".npy") and not filename.startswith(stamp + "-"):
+                os.remove(os.path.join(entry_dir, filename))
+        return manifest
+
+    def load(self, path: str, columns, filetype: str = None, numeric=()) -> dict:
+        """
+        Memory-map columns of a CSV/tabular file, building its cache entry if needed.
+
+        Args:
+            path: Input file
+            columns: Column names to load
+            filetype: 'csv' or 'tabular'; guessed from the header when None
+            numeric: Columns to return as float arrays (empty or invalid entries
+                     are NaN) instead of raw strings
+
+        Returns:
+            dict: column name -> read-only NumPy array
+        """
+        import numpy as np
+
+        entry_dir = self.entry_dir(path)
+        with self._lock:
+            manifest = self._fresh_manifest(path, entry_dir, filetype)
+            if manifest is None:
+                manifest = self._build(path, entry_dir, filetype)
+
+            missing = [column for column in columns if column not in manifest['columns']]
+            if missing:
+                raise KeyError(f"Column(s) {missing} not found in {path} "
+                               f"(columns: {list(manifest['columns'])})")
+
+            arrays = {}
+            for column in columns:
+                files = manifest['columns'][column]
+                if column not in numeric:
+                    arrays[column] = np.load(os.path.join(entry_dir, files['raw']), mmap_mode='r')
+                    continue
+                if files['float'] is None:
+                    raw_values = np.load(os.path.join(entry_dir, files['raw']), mmap_mode='r')
+                    files['float'] = files['raw'][:-len(".str.npy")] + ".f8.npy"
+                    self._save_array(os.path.join(entry_dir, files['float']), to_float_array(raw_values))
+                    self._save_manifest(entry_dir, manifest)
+                arrays[column] = np.load(os.path.join(entry_dir, files['float']), mmap_mode='r')
+        return arrays
+
+    def clear(self, path: str = None):
+        """Drop the entry of path, or the whole cache."""
+        with self._lock:
+            shutil.rmtree(self.entry_dir(path) if path else self.cache_dir, ignore_errors=True)
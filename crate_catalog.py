@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Queryable catalog of Galaxy invocation RO-Crates
+Walks a directory of crates (ZIPs or extracted directories), loads each one
+with galaxy_rocrate.load_galaxy_crate and stores its rerun information
+(workflow, formal inputs/outputs, actual parameters, input and output files)
+in a SQLite catalog. Indexing is incremental: a crate is loaded again only
+when its size changes or its mtime changes together with its SHA-256, and
+crates that disappeared are dropped. Queries such as "all runs using colormap
+RdBu_r" or "all runs on input X" are answered from the catalog without
+opening any ZIP.
+
+    python crate_catalog.py index downloaded_rocrate
+    python crate_catalog.py query --parameter colormap=RdBu_r --input dataset_1.tabular
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from download_cache import sha256sum
+from galaxy_rocrate import load_galaxy_crate
+from instrumentation import configure as configure_profiling, span
+from prepare_inputs_and_parameters import find_rocrates
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.expanduser("~"), ".cache", "warming-stripes", "crate_catalog.sqlite")
+
+# Separator of nested parameter names, as in Galaxy tool states (e.g. adv|colormap)
+PARAMETER_SEPARATOR = '|'
+
+# Files of an extracted crate whose changes require indexing it again
+DIRECTORY_CRATE_FILES = ('ro-crate-metadata.json', 'invocation_attrs.txt')
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS crates ("
+    " id INTEGER PRIMARY KEY,"
+    " path TEXT NOT NULL UNIQUE,"
+    " size INTEGER NOT NULL,"
+    " mtime_ns INTEGER NOT NULL,"
+    " sha256 TEXT,"
+    " workflow_name TEXT,"
+    " state TEXT,"
+    " create_time TEXT,"
+    " invocation_error TEXT,"
+    " info TEXT NOT NULL,"
+    " indexed REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS parameters ("
+    " crate_id INTEGER NOT NULL REFERENCES crates (id) ON DELETE CASCADE,"
+    " name TEXT NOT NULL,"
+    " key TEXT NOT NULL,"
+    " value TEXT)",
+    "CREATE TABLE IF NOT EXISTS files ("
+    " crate_id INTEGER NOT NULL REFERENCES crates (id) ON DELETE CASCADE,"
+    " role TEXT NOT NULL,"
+    " name TEXT,"
+    " path TEXT NOT NULL,"
+    " basename TEXT NOT NULL,"
+    " format TEXT)",
+    "CREATE TABLE IF NOT EXISTS formal_parameters ("
+    " crate_id INTEGER NOT NULL REFERENCES crates (id) ON DELETE CASCADE,"
+    " role TEXT NOT NULL,"
+    " name TEXT,"
+    " type TEXT,"
+    " description TEXT)",
+    "CREATE INDEX IF NOT EXISTS parameters_key ON parameters (key, value)",
+    "CREATE INDEX IF NOT EXISTS parameters_name ON parameters (name, value)",
+    "CREATE INDEX IF NOT EXISTS parameters_crate ON parameters (crate_id)",
+    "CREATE INDEX IF NOT EXISTS files_name ON files (role, name)",
+    "CREATE INDEX IF NOT EXISTS files_path ON files (role, path)",
+    "CREATE INDEX IF NOT EXISTS files_basename ON files (role, basename)",
+    "CREATE INDEX IF NOT EXISTS files_crate ON files (crate_id)",
+    "CREATE INDEX IF NOT EXISTS formal_parameters_crate ON formal_parameters (crate_id)",
+    "CREATE INDEX IF NOT EXISTS crates_workflow ON crates (workflow_name)",
+]
+
+
+def crate_stat(path):
+    """
+    Size and mtime (ns) identifying the version of a crate.
+
+    For an extracted crate they are summed over DIRECTORY_CRATE_FILES.
+    """
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    size = mtime_ns = 0
+    for name in DIRECTORY_CRATE_FILES:
+        member = os.path.join(path, name)
+        if os.path.exists(member):
+            stat = os.stat(member)
+            size += stat.st_size
+            mtime_ns = max(mtime_ns, stat.st_mtime_ns)
+    return size, mtime_ns
+
+
+def parameter_value(value):
+    """Text stored for a parameter value: strings as they are, anything else as JSON."""
+    return value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+
+
+def flatten_parameters(parameters, prefix=''):
+    """
+    Flatten nested actual parameters.
+
+    Returns:
+        list of (name, key, value): name is the full path ('adv|colormap'), key
+        its last part ('colormap') and value the text from parameter_value
+    """
+    rows = []
+    for key, value in parameters.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            rows.extend(flatten_parameters(value, name + PARAMETER_SEPARATOR))
+        else:
+            rows.append((name, str(key), parameter_value(value)))
+    return rows
+
+
+def _load_catalog_item(path):
+    """
+    Load and hash one crate in a worker process; errors are returned, not raised.
+
+    Returns:
+        tuple (path, info, sha256, error): sha256 is None for extracted crate directories
+    """
+    try:
+        info = load_galaxy_crate(path)
+        sha256 = None if os.path.isdir(path) else sha256sum(path)
+        return path, info, sha256, None
+    except Exception as e:
+        return path, None, None, f"{type(e).__name__}: {e}"
+
+
+class CrateCatalog:
+    """SQLite catalog of crate rerun information, one row per crate path."""
+
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path: SQLite file (default: $WARMING_STRIPES_CATALOG or ~/.cache/warming-stripes/crate_catalog.sqlite)
+        """
+        self.path = path or os.environ.get("WARMING_STRIPES_CATALOG", DEFAULT_CATALOG_PATH)
+        self._lock = threading.Lock()
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        with self._db:
+            for statement in SCHEMA:
+                self._db.execute(statement)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _is_fresh(self, path, size, mtime_ns):
+        """True if the catalog entry of path still describes the crate on disk."""
+        row = self._db.execute("SELECT id, size, mtime_ns, sha256 FROM crates WHERE path = ?",
+                               (path,)).fetchone()
+        if row is None or row[1] != size:
+            return False
+        if row[2] == mtime_ns:
+            return True
+        # Touched, copied or downloaded again: only index again if the content changed
+        if row[3] is None or sha256sum(path) != row[3]:
+            return False
+        with self._db:
+            self._db.execute("UPDATE crates SET mtime_ns = ? WHERE id = ?", (mtime_ns, row[0]))
+        return True
+
+    def _store(self, path, size, mtime_ns, sha256, info):
+        self._db.execute("DELETE FROM crates WHERE path = ?", (path,))
+        crate_id = self._db.execute(
+            "INSERT INTO crates (path, size, mtime_ns, sha256, workflow_name, state, create_time,"
+            " invocation_error, info, indexed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, size, mtime_ns, sha256, info['workflow_name'], info['state'], info['create_time'],
+             info['invocation_error'], json.dumps(info, default=str), time.time())).lastrowid
+        self._db.executemany(
+            "INSERT INTO parameters (crate_id, name, key, value) VALUES (?, ?, ?, ?)",
+            [(crate_id, *row) for row in flatten_parameters(info['actual_parameters'])])
+        self._db.executemany(
+            "INSERT INTO files (crate_id, role, name, path, basename, format) VALUES (?, ?, ?, ?, ?, ?)",
+            [(crate_id, role, file_info['name'], file_info['path'], os.path.basename(file_info['path']),
+              file_info['format'])
+             for role, files in (('input', info['input_files']), ('output', info['output_files']))
+             for file_info in files])
+        self._db.executemany(
+            "INSERT INTO formal_parameters (crate_id, role, name, type, description) VALUES (?, ?, ?, ?, ?)",
+            [(crate_id, role, parameter['name'], parameter['type'], parameter['description'])
+             for role, parameters in (('input', info['formal_inputs']), ('output', info['formal_outputs']))
+             for parameter in parameters])
+
+    def index(self, rocrates, workers=None, prune_dir=None):
+        """
+        Bring the catalog up to date with a list of crates.
+
+        Unchanged crates are skipped; the others are loaded across a process
+        pool, which also hashes them, and written in one transaction.
+
+        Args:
+            rocrates: Crate paths (see prepare_inputs_and_parameters.find_rocrates)
+            workers: Number of worker processes (default: number of CPUs; 1 loads in this process)
+            prune_dir: Drop catalog entries below this directory that are not in rocrates
+
+        Returns:
+            dict with the indexed, unchanged, removed and failed ({path: error}) crates
+        """
+        paths = [os.path.abspath(path) for path in rocrates]
+        with self._lock:
+            stats = {path: crate_stat(path) for path in paths}
+            with span("catalog.check", crates=len(paths)):
+                changed = [path for path in paths if not self._is_fresh(path, *stats[path])]
+
+            with span("catalog.load", crates=len(changed)):
+                if workers == 1 or len(changed) < 2:
+                    loaded = list(map(_load_catalog_item, changed))
+                else:
+                    from concurrent.futures import ProcessPoolExecutor
+                    with ProcessPoolExecutor(max_workers=workers) as executor:
+                        chunksize = max(1, len(changed) // (4 * (workers or os.cpu_count() or 1)))
+                        loaded = list(executor.map(_load_catalog_item, changed, chunksize=chunksize))
+
+            failed = {}
+            removed = []
+            with span("catalog.write"), self._db:
+                for path, info, sha256, error in loaded:
+                    if error:
+                        failed[path] = error
+                        self._db.execute("DELETE FROM crates WHERE path = ?", (path,))
+                    else:
+                        self._store(path, *stats[path], sha256, info)
+                if prune_dir is not None:
+                    prefix = os.path.join(os.path.abspath(prune_dir), '')
+                    known = set(paths)
+                    for (path,) in self._db.execute("SELECT path FROM crates").fetchall():
+                        if path.startswith(prefix) and path not in known:
+                            removed.append(path)
+                            self._db.execute("DELETE FROM crates WHERE path = ?", (path,))
+
+        changed = set(changed)
+        return {'indexed': [path for path, info, sha256, error in loaded if not error],
+                'unchanged': [path for path in paths if path not in changed],
+                'removed': removed, 'failed': failed}
+
+    def find_runs(self, parameters=(), inputs=(), outputs=(), workflow=None, state=None) -> list:
+        """
+        Crates matching all the given criteria.
+
+        Args:
+            parameters: (name, value) pairs; name is a full parameter path
+                        ('adv|colormap') or its last part ('colormap')
+            inputs: Input file names, crate paths or file names of crate paths
+            outputs: Same for output files
+            workflow: Workflow name
+            state: Invocation state (e.g. 'scheduled')
+
+        Returns:
+            list of dicts with path, workflow_name, state and create_time, oldest run first
+        """
+        clauses = []
+        args = []
+        for name, value in parameters:
+            column = 'name' if PARAMETER_SEPARATOR in name else 'key'
+            clauses.append(f"id IN (SELECT crate_id FROM parameters WHERE {column} = ? AND value = ?)")
+            args.extend([name, parameter_value(value)])
+        for role, names in (('input', inputs), ('output', outputs)):
+            for name in names:
+                clauses.append("id IN (SELECT crate_id FROM files WHERE role = ? AND name = ?"
+                               " UNION SELECT crate_id FROM files WHERE role = ? AND path = ?"
+                               " UNION SELECT crate_id FROM files WHERE role = ? AND basename = ?)")
+                args.extend([role, name] * 3)
+        if workflow is not None:
+            clauses.append("workflow_name = ?")
+            args.append(workflow)
+        if state is not None:
+            clauses.append("state = ?")
+            args.append(state)
+
+        query = "SELECT path, workflow_name, state, create_time FROM crates"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY create_time, path"
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        return [{'path': path, 'workflow_name': workflow_name, 'state': state, 'create_time': create_time}
+                for path, workflow_name, state, create_time in rows]
+
+    def get(self, path):
+        """Rerun information of a catalogued crate (as from load_galaxy_crate), or None."""
+        with self._lock:
+            row = self._db.execute("SELECT info FROM crates WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def parameter_values(self, name) -> dict:
+        """Value -> number of catalogued runs, for a parameter path or last part."""
+        column = 'name' if PARAMETER_SEPARATOR in name else 'key'
+        with self._lock:
+            rows = self._db.execute(f"SELECT value, COUNT(DISTINCT crate_id) FROM parameters WHERE {column} = ?"
+                                    " GROUP BY value ORDER BY 2 DESC, 1", (name,)).fetchall()
+        return dict(rows)
+
+
+def _parameter_filter(text):
+    if '=' not in text:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {text!r}")
+    return tuple(text.split('=', 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Index Galaxy RO-Crates in a SQLite catalog and query their runs",
+        epilog="Example: python crate_catalog.py query --parameter colormap=RdBu_r")
+    parser.add_argument("--catalog", default=None,
+                        help="SQLite catalog (default: $WARMING_STRIPES_CATALOG or "
+                             "~/.cache/warming-stripes/crate_catalog.sqlite)")
+    parser.add_argument("--profile", default=None,
+                        help="Append per-stage timing spans (JSON lines) to this file, '-' for stderr "
+                             "(also $WARMING_STRIPES_PROFILE)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = commands.add_parser("index", help="Add new and changed crates to the catalog")
+    index_parser.add_argument("source", help="Directory holding *.zip crates and/or extracted crate directories, "
+                                             "or a manifest file with one crate path per line")
+    index_parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    index_parser.add_argument("--keep-missing", action="store_true",
+                              help="Keep catalog entries of crates no longer in the source directory")
+
+    query_parser = commands.add_parser("query", help="List the catalogued runs matching all criteria")
+    query_parser.add_argument("--parameter", action="append", type=_parameter_filter, default=[],
+                              metavar="NAME=VALUE", help="Actual parameter value, e.g. colormap=RdBu_r or "
+                                                         "adv|colormap=RdBu_r (repeatable)")
+    query_parser.add_argument("--input", action="append", default=[],
+                              help="Input file name or path in the crate (repeatable)")
+    query_parser.add_argument("--output", action="append", default=[],
+                              help="Output file name or path in the crate (repeatable)")
+    query_parser.add_argument("--workflow", default=None, help="Workflow name")
+    query_parser.add_argument("--state", default=None, help="Invocation state")
+    query_parser.add_argument("--json", action="store_true", help="Print the matching runs as JSON")
+
+    values_parser = commands.add_parser("values", help="Count the runs per value of a parameter")
+    values_parser.add_argument("parameter", help="Parameter name, e.g. colormap or adv|colormap")
+
+    args = parser.parse_args()
+    configure_profiling(args.profile)
+
+    with CrateCatalog(args.catalog) as catalog:
+        if args.command == "index":
+            rocrates = find_rocrates(args.source)
+            start = time.perf_counter()
+            prune_dir = args.source if os.path.isdir(args.source) and not args.keep_missing else None
+            result = catalog.index(rocrates, args.workers, prune_dir)
+            for path, error in result['failed'].items():
+                print(f"✗ {path}: {error}")
+            print(f"✓ {len(result['indexed'])} indexed, {len(result['unchanged'])} unchanged, "
+                  f"{len(result['removed'])} removed, {len(result['failed'])} failed "
+                  f"in {time.perf_counter() - start:.2f} s ({catalog.path})")
+            sys.exit(1 if result['failed'] else 0)
+
+        if args.command == "values":
+            for value, count in catalog.parameter_values(args.parameter).items():
+                print(f"{count:>6}  {value}")
+            sys.exit(0)
+
+        runs = catalog.find_runs(args.parameter, args.input, args.output, args.workflow, args.state)
+        if args.json:
+            print(json.dumps(runs, indent=2))
+        else:
+            for run in runs:
+                print(f"{run['create_time'] or '-':<28} {run['state'] or '-':<12} "
+                      f"{run['workflow_name'] or '-'}  {run['path']}")
+            print(f"{len(runs)} run(s)")
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Content-addressed download cache for RO-Crates and workflow files
+Downloads are written to a ".part" file, resumed with HTTP Range requests
+when interrupted, verified (size, SHA-256, ZIP central directory) and only
+then moved into place. Verified files are stored once per content hash and
+indexed by a key (e.g. the ROHub research object id), so a crate that is
+still current is never downloaded again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zipfile
+from typing import Optional
+
+from instrumentation import span
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "warming-stripes", "rocrates")
+# Cached crates checked against their source less than this many seconds ago are used without asking it again
+DEFAULT_MAX_AGE = 24 * 3600
+CHUNK_SIZE = 1 << 20
+
+
+class IntegrityError(Exception):
+    """Raised when a downloaded or cached file does not match its expected content."""
+
+
+def sha256sum(path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_zip(path: str, test_members: bool = False) -> bool:
+    """
+    Check that path is a readable ZIP archive.
+
+    By default only the central directory is read, and the archive must
+    start with its first member: zipfile accepts data prepended to an
+    archive, such as a stale partial download. With test_members, every
+    member is also decompressed and checked against its CRC.
+    """
+    try:
+        with zipfile.ZipFile(path) as zip_file:
+            members = zip_file.infolist()
+            if not members or min(member.header_offset for member in members) != 0:
+                return False
+            return not test_members or zip_file.testzip() is None
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+
+def verify_file(path: str, sha256: str = None, size: int = None, is_zip: bool = False,
+                test_members: bool = False):
+    """Raise IntegrityError unless path has the expected size, hash and ZIP structure (see verify_zip)."""
+    if size is not None and os.path.getsize(path) != size:
+        raise IntegrityError(f"{path}: expected {size} bytes, found {os.path.getsize(path)}")
+    if is_zip and not verify_zip(path, test_members):
+        raise IntegrityError(f"{path}: not a valid ZIP archive")
+    if sha256 is not None:
+        actual = sha256sum(path)
+        if actual != sha256.lower():
+            raise IntegrityError(f"{path}: expected sha256 {sha256}, found {actual}")
+
+
+def _expected_total(response, offset: int) -> Optional[int]:
+    """Total size of the resource from Content-Range/Content-Length, if the server sent it."""
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range and not content_range.endswith('/*'):
+        return int(content_range.rsplit('/', 1)[1])
+    content_length = response.headers.get('Content-Length')
+    if content_length is not None:
+        return offset + int(content_length)
+    return None
+
+
+def _resume_validator(part_path: str, url: str) -> Optional[str]:
+    """
+    If-Range value recorded for a partial download of url, or None if it cannot be resumed.
+
+    The ETag (strong only) or Last-Modified of the response a .part file was
+    started from is saved next to it, with the URL.
+    """
+    try:
+        with open(part_path + ".json") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('url') != url:
+        return None
+    return state.get('validator')
+
+
+def _response_validator(response) -> Optional[str]:
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def _discard_part(part_path: str):
+    for stale_path in (part_path, part_path + ".json"):
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+
+
+def download_file(url: str, path: str, session=None, sha256: str = None, size: int = None,
+                  is_zip: bool = False, chunk_size: int = CHUNK_SIZE, timeout: float = 60,
+                  headers: dict = None, retries: int = 3, verbose: bool = False) -> str:
+    """
+    Download url to path, resuming a previous partial download if there is one.
+
+    The data goes to path + ".part"; when the server honours Range requests an
+    existing partial file is continued instead of restarted, also between
+    retries. A partial file is only continued if it was started from the same
+    URL and the server confirms, through If-Range with the ETag or
+    Last-Modified recorded in path + ".part.json", that the resource did not
+    change; otherwise the download restarts from zero. Without a validator, a
+    transfer is only resumed by the retries of the call that started it. The size announced by
+    the server (Content-Length/Content-Range) is checked, and the file is moved
+    to path only once it passed verify_file (with the CRC of every ZIP member
+    when no sha256 is given).
+
+    Args:
+        url: URL to download
+        path: Destination file
+        session: requests.Session to use
+        sha256, size, is_zip: Expected content, see verify_file
+        chunk_size: Read/write buffer size, in bytes
+        timeout: Connect/read timeout, in seconds
+        headers: Extra request headers (e.g. authentication)
+        retries: Number of attempts resuming an interrupted transfer
+        verbose: Print size and throughput
+
+    Returns:
+        path
+    """
+    import requests
+
+    session = session or requests.Session()
+    part_path = path + ".part"
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    start = time.monotonic()
+    transferred = 0
+    with span("http.download", url=url) as stage:
+        started = False
+        for attempt in range(1, retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            validator = _resume_validator(part_path, url) if offset else None
+            if offset and not validator and not started:
+                # Left by another URL or by a response without validator: cannot be trusted
+                _discard_part(part_path)
+                offset = 0
+            request_headers = dict(headers or {})
+            if offset:
+                request_headers['Range'] = f"bytes={offset}-"
+                if validator:
+                    request_headers['If-Range'] = validator
+            try:
+                with session.get(url, headers=request_headers, stream=True, timeout=timeout) as response:
+                    if response.status_code == 416:
+                        # Range beyond the end of the unchanged resource: the partial file holds everything
+                        break
+                    response.raise_for_status()
+                    if offset and (response.status_code != 206 or
+                                   _response_validator(response) not in (None, validator)):
+                        # Resource changed (If-Range) or Range ignored: start over
+                        offset = 0
+                    if not offset:
+                        with open(part_path + ".json", 'w') as f:
+                            json.dump({'url': url, 'validator': _response_validator(response)}, f)
+                        started = True
+                    total = _expected_total(response, offset)
+                    if size is None:
+                        size = total
+                    with open(part_path, 'ab' if offset else 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            transferred += len(chunk)
+                            stage.add_bytes(len(chunk))
+                if total is None or os.path.getsize(part_path) >= total:
+                    break
+                print(f"Transfer of {url} stopped at {os.path.getsize(part_path)}/{total} bytes, resuming")
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == retries:
+                    raise
+                print(f"Transfer of {url} interrupted ({e}), resuming (attempt {attempt + 1}/{retries})")
+
+    if size is not None and os.path.getsize(part_path) < size:
+        # Keep the partial file so that the next call resumes it
+        raise IntegrityError(f"{url}: incomplete download ({os.path.getsize(part_path)}/{size} bytes)")
+    try:
+        with span("http.verify", url=url):
+            verify_file(part_path, sha256=sha256, size=size, is_zip=is_zip, test_members=sha256 is None)
+    except IntegrityError:
+        _discard_part(part_path)
+        raise
+    os.replace(part_path, path)
+    _discard_part(part_path)
+
+    if verbose:
+        elapsed = max(time.monotonic() - start, 1e-6)
+        print(f"Downloaded {os.path.getsize(path) / 1e6:.1f} MB to {path} "
+              f"({transferred / 1e6:.1f} MB transferred in {elapsed:.1f} s, {transferred / 1e6 / elapsed:.1f} MB/s)")
+    return path
+
+
+class ROCrateCache:
+    """
+    Store of verified RO-Crates addressed by SHA-256 and indexed by key.
+
+    Layout: <cache_dir>/objects/<sha256>.zip and <cache_dir>/index.json, which
+    maps each key to the hash, size, mtime and version (e.g. modification
+    date) of the last verified download, and to when that version was last
+    checked against the source. Objects are only hashed again when their
+    size or mtime changed.
+    """
+
+    def __init__(self, cache_dir: str = None, max_age: float = None):
+        """
+        Args:
+            cache_dir: Cache directory (default: $WARMING_STRIPES_ROCRATE_CACHE or ~/.cache/warming-stripes/rocrates)
+            max_age: Seconds during which a checked entry is used without asking its source
+                     for the current version (default: $WARMING_STRIPES_ROCRATE_MAX_AGE or one day)
+        """
+        self.cache_dir = cache_dir or os.environ.get("WARMING_STRIPES_ROCRATE_CACHE", DEFAULT_CACHE_DIR)
+        if max_age is None:
+            max_age = float(os.environ.get("WARMING_STRIPES_ROCRATE_MAX_AGE", DEFAULT_MAX_AGE))
+        self.max_age = max_age
+        self.objects_dir = os.path.join(self.cache_dir, "objects")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def _load_index(self) -> dict:
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def _save_index(self, index: dict):
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _update_entry(self, key: str, entry: dict, **changes):
+        """Record changes to the index entry of key, unless it was replaced meanwhile."""
+        with self._lock:
+            index = self._load_index()
+            if index.get(key, {}).get('sha256') == entry['sha256']:
+                index[key].update(changes)
+                self._save_index(index)
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, f"{sha256}.zip")
+
+    def _verified_path(self, key: str, entry: dict) -> Optional[str]:
+        """
+        Path of the object of entry if it is intact, else None.
+
+        The object is hashed again only when its size or mtime differs from
+        the index; otherwise its ZIP central directory is checked.
+        """
+        path = self.object_path(entry['sha256'])
+        try:
+            stat = os.stat(path)
+            if stat.st_size != entry['size']:
+                return None
+            if stat.st_mtime_ns == entry.get('mtime_ns'):
+                verify_file(path, is_zip=True)
+            else:
+                verify_file(path, sha256=entry['sha256'], is_zip=True)
+                self._update_entry(key, entry, mtime_ns=stat.st_mtime_ns)
+        except (IntegrityError, OSError):
+            return None
+        return path
+
+    def lookup(self, key: str, version: str = None) -> Optional[str]:
+        """
+        Return the cached crate for key, or None if it is missing, stale or corrupt.
+
+        A matching version marks the entry as checked now (see recent).
+
+        Args:
+            key: Cache key, e.g. a ROHub research object id
+            version: Current remote version; None accepts any cached version
+        """
+        with self._lock:
+            entry = self._load_index().get(key)
+        if not entry:
+            return None
+        if version is not None and entry.get('version') != version:
+            return None
+        path = self._verified_path(key, entry)
+        if path and version is not None:
+            self._update_entry(key, entry, checked=time.time())
+        return path
+
+    def recent(self, key: str) -> Optional[str]:
+        """
+        Return the cached crate for key if its version was checked less than max_age seconds ago.
+
+        Such a crate can be used without asking its source for the current version.
+        """
+        with self._lock:
+            entry = self._load_index().get(key)
+        if not entry:
+            return None
+        checked = entry.get('checked', entry.get('stored', 0))
+        if time.time() - checked >= self.max_age:
+            return None
+        return self._verified_path(key, entry)
+
+    def store(self, key: str, path: str, version: str = None) -> str:
+        """Verify path as a ZIP, move it into the store and index it under key."""
+        verify_file(path, is_zip=True, test_members=True)
+        sha256 = sha256sum(path)
+        object_path = self.object_path(sha256)
+        if os.path.exists(object_path):
+            os.remove(path)
+        else:
+            shutil.move(path, object_path)
+        stat = os.stat(object_path)
+        now = time.time()
+        with self._lock:
+            index = self._load_index()
+            index[key] = {'sha256': sha256, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                          'version': version, 'stored': now, 'checked': now}
+            self._save_index(index)
+        return object_path
+
+    @staticmethod
+    def materialize(object_path: str, target: str) -> str:
+        """Make a cached object available at target (hard link when possible, else copy)."""
+        if os.path.dirname(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            if os.path.samefile(object_path, target):
+                return target
+            os.remove(target)
+        try:
+            os.link(object_path, target)
+        except OSError:
+            shutil.copy2(object_path, target)
+        return target
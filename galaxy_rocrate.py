@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+"""
+Galaxy invocation RO-Crate model
+Parses a Galaxy invocation RO-Crate once and exposes the rerun information
+shared by prepare_inputs_and_parameters.py and extract_md_from_galaxy_rocrate.py.
+"""
+
+import ast
+import functools
+import json
+import os
+import shutil
+import zipfile
+from collections import defaultdict, deque
+
+from instrumentation import instrumented, span
+from streaming_json import iter_json_objects
+
+# Step state keys that are Galaxy internals rather than workflow parameters
+IGNORED_PARAMETERS = ['chromInfo', 'dbkey']
+
+# Members of an invocation record used by parse_invocation; the rest
+# (steps, jobs, collections) is skipped while streaming invocation_attrs.txt,
+# one element at a time, without being kept
+INVOCATION_KEYS = ['state', 'create_time', 'input_parameters', 'step_states',
+                   'input_datasets', 'output_datasets']
+
+# Members of a datasets_attrs.txt record needed to locate dataset files
+DATASET_KEYS = ['encoded_id', 'file_name']
+
+# Dataset files of a crate, told apart as inputs or outputs by their extension
+DATASETS_PREFIX = 'datasets/'
+INPUT_FILE_EXTENSIONS = ('.tabular', '.csv')
+OUTPUT_FILE_EXTENSIONS = ('.png', '.jpg')
+
+
+def clean_parameter_value(param_value):
+    """Strip the extra quoting Galaxy adds to step state values."""
+    if isinstance(param_value, str) and param_value.startswith('"') and param_value.endswith('"'):
+        param_value = param_value[1:-1]
+    elif isinstance(param_value, str) and param_value.startswith('{'):
+        try:
+            param_value = json.loads(param_value)
+        except ValueError:
+            pass
+    return param_value
+
+
+def parse_invocation(invocation_data):
+    """
+    Extract execution information from one invocation_attrs.txt record.
+
+    Args:
+        invocation_data: First element of the invocation_attrs.txt JSON list
+
+    Returns:
+        dict with state, create_time, workflow_parameters, actual_parameters,
+        input_datasets and output_datasets
+    """
+    workflow_parameters = []
+    # Extract workflow input parameters
+    for input_parameter in invocation_data.get('input_parameters', []):
+        if "WorkflowRequestInputParameter" in input_parameter.values():
+            if input_parameter["value"] != "false":
+                workflow_parameters.append(ast.literal_eval(input_parameter["value"]))
+
+    # Extract actual parameters used
+    actual_params = {}
+    for step_state in invocation_data.get('step_states', []):
+        step_value = step_state.get('value', {})
+        for param_name, param_value in step_value.items():
+            if not param_name.startswith('__') and param_name not in IGNORED_PARAMETERS:
+                actual_params[param_name] = clean_parameter_value(param_value)
+
+    # Get input/output dataset info
+    input_datasets = []
+    for inp_ds in invocation_data.get('input_datasets', []):
+        dataset_id = inp_ds.get('dataset', {}).get('encoded_id')
+        input_datasets.append({
+            'dataset_id': dataset_id,
+            'order': inp_ds.get('order_index', 0)
+        })
+
+    output_datasets = []
+    for out_ds in invocation_data.get('output_datasets', []):
+        dataset_id = out_ds.get('dataset', {}).get('encoded_id')
+        label = out_ds.get('workflow_output', {}).get('label')
+        output_datasets.append({
+            'dataset_id': dataset_id,
+            'label': label,
+            'order': out_ds.get('order_index', 0)
+        })
+
+    return {
+        'state': invocation_data.get('state'),
+        'create_time': invocation_data.get('create_time'),
+        'workflow_parameters': workflow_parameters,
+        'actual_parameters': actual_params,
+        'input_datasets': input_datasets,
+        'output_datasets': output_datasets
+    }
+
+
+def read_invocation(fileobj):
+    """
+    Parse an open invocation_attrs.txt file (we assume one invocation).
+
+    The file is streamed and only the members listed in INVOCATION_KEYS are
+    decoded, so it can be read straight from a ZIP member of any size.
+    """
+    for invocation_data in iter_json_objects(fileobj, 'item', keys=INVOCATION_KEYS):
+        return parse_invocation(invocation_data)
+    raise ValueError("No invocation found in invocation_attrs.txt")
+
+
+def find_files(directory, patterns, first_only=()):
+    """
+    Find files matching several suffix or name patterns in a single walk.
+
+    The tree is walked breadth-first with os.scandir, so directory entries are
+    classified without a stat call per file. The walk stops as soon as every
+    pattern listed in first_only has a match and no other pattern is pending.
+
+    Args:
+        directory (str): Root directory to search
+        patterns (list): File name suffixes or full names (e.g. ".ga", "jobs_attrs.txt")
+        first_only (iterable): Patterns for which the first match is enough
+
+    Returns:
+        dict: pattern -> list of full paths of the matching files
+    """
+    matches = {pattern: [] for pattern in patterns}
+    first_only = set(first_only)
+    pending = [pattern for pattern in patterns if pattern not in first_only]
+
+    queue = deque([directory])
+    while queue:
+        subdirs = []
+        with os.scandir(queue.popleft()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                for pattern, found in matches.items():
+                    if entry.name.endswith(pattern) and not (found and pattern in first_only):
+                        found.append(entry.path)
+        if not pending and all(matches[pattern] for pattern in first_only):
+            break
+        queue.extend(sorted(subdirs))
+    return matches
+
+
+class GalaxyCrateDirectory:
+    """
+    Access to an already extracted Galaxy invocation RO-Crate.
+
+    Offers the same interface as GalaxyCrateArchive, with member names
+    relative to the crate directory.
+    """
+
+    def __init__(self, directory):
+        self.path = directory
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def _name(self, path):
+        return os.path.relpath(path, self.path).replace(os.sep, '/')
+
+    def find_all(self, patterns, first_only=()) -> dict:
+        """Return pattern -> member names for several patterns in one walk."""
+        found = find_files(self.path, patterns, first_only)
+        return {pattern: [self._name(path) for path in paths] for pattern, paths in found.items()}
+
+    def find(self, suffix: str) -> list:
+        return self.find_all([suffix])[suffix]
+
+    def open(self, name: str):
+        return open(os.path.join(self.path, name), 'rb')
+
+    def read(self, name: str) -> bytes:
+        with self.open(name) as f:
+            return f.read()
+
+    def size(self, name: str) -> int:
+        return os.path.getsize(os.path.join(self.path, name))
+
+    def extract(self, names, output_dir: str) -> list:
+        """Copy the given members below output_dir, unless the crate already lives there."""
+        paths = []
+        for name in names:
+            source = os.path.join(self.path, name)
+            target = os.path.join(output_dir, name)
+            if not os.path.exists(target) or not os.path.samefile(source, target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(source, target)
+            paths.append(target)
+        return paths
+
+
+class GalaxyCrateArchive:
+    """
+    Lazy access to the members of a Galaxy invocation RO-Crate ZIP.
+
+    The ZIP central directory is indexed once when the archive is opened.
+    Metadata members are read in memory and only the requested dataset files
+    are ever written to disk.
+    """
+
+    def __init__(self, rocrate_zip_path):
+        self.path = rocrate_zip_path
+        self.zip_file = zipfile.ZipFile(rocrate_zip_path, 'r')
+        self.members = {info.filename: info for info in self.zip_file.infolist()
+                        if not info.is_dir()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.zip_file.close()
+
+    def find_all(self, patterns, first_only=()) -> dict:
+        """Return pattern -> member names ending with each pattern, in archive order."""
+        first_only = set(first_only)
+        matches = {pattern: [] for pattern in patterns}
+        for name in self.members:
+            for pattern, found in matches.items():
+                if name.endswith(pattern) and not (found and pattern in first_only):
+                    found.append(name)
+        return matches
+
+    def find(self, suffix: str) -> list:
+        """Return the member names ending with suffix, in archive order."""
+        return self.find_all([suffix])[suffix]
+
+    def open(self, name: str):
+        """Open a member as a binary file object without extracting it."""
+        return self.zip_file.open(self.members[name])
+
+    def read(self, name: str) -> bytes:
+        return self.zip_file.read(self.members[name])
+
+    def size(self, name: str) -> int:
+        """Uncompressed size of a member."""
+        return self.members[name].file_size
+
+    def extract(self, names, output_dir: str) -> list:
+        """
+        Extract the given members below output_dir.
+
+        Members already present on disk with the same size are not rewritten.
+
+        Returns:
+            list of the extracted file paths, in the order of names
+        """
+        paths = []
+        for name in names:
+            info = self.members[name]
+            target = os.path.join(output_dir, name)
+            if not (os.path.isfile(target) and os.path.getsize(target) == info.file_size):
+                target = self.zip_file.extract(info, output_dir)
+            paths.append(target)
+        return paths
+
+
+def open_galaxy_crate(path):
+    """Open a Galaxy RO-Crate given as a ZIP file or as an extracted directory."""
+    with span("crate.open", rocrate=path):
+        if os.path.isdir(path):
+            return GalaxyCrateDirectory(path)
+        return GalaxyCrateArchive(path)
+
+
+METADATA_FILENAME = 'ro-crate-metadata.json'
+
+
+@functools.lru_cache(maxsize=None)
+def _orjson():
+    """orjson, imported on first use, or None when it is not installed."""
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+def json_loads(data):
+    """Decode JSON bytes, with orjson when it is installed."""
+    orjson = _orjson()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class Entity:
+    """
+    One entity of a ro-crate-metadata.json graph.
+
+    A light record over the JSON-LD dict: id and type are attributes,
+    other properties are read with get(), and references stay {'@id': ...} dicts.
+    """
+
+    __slots__ = ('id', 'type', 'properties')
+
+    def __init__(self, properties):
+        self.id = properties['@id']
+        self.type = properties.get('@type', [])
+        self.properties = properties
+
+    def get(self, key, default=None):
+        return self.properties.get(key, default)
+
+    def __getitem__(self, key):
+        return self.properties[key]
+
+    def __repr__(self):
+        return f"Entity({self.id!r}, type={self.type!r})"
+
+
+def read_crate_metadata(crate):
+    """
+    Read the entities of an open crate's ro-crate-metadata.json.
+
+    The metadata file is read straight from the ZIP (or directory) and
+    decoded in one call; no entity objects beyond Entity records are built
+    and nothing is extracted.
+
+    Args:
+        crate: GalaxyCrateArchive or GalaxyCrateDirectory
+
+    Returns:
+        list of Entity, in graph order
+    """
+    names = crate.find(METADATA_FILENAME)
+    if not names:
+        raise FileNotFoundError(f"No {METADATA_FILENAME} in {crate.path}")
+    # The crate root holds the metadata file; nested crates may hold others
+    name = min(names, key=lambda name: name.count('/'))
+    with span("crate.metadata") as stage:
+        stage.add_bytes(crate.size(name))
+        metadata = json_loads(crate.read(name))
+    return [Entity(properties) for properties in metadata.get('@graph', []) if '@id' in properties]
+
+
+def _entity_ids(value):
+    """Return the @id of each entity referenced by a (possibly single) property value."""
+    if not isinstance(value, list):
+        value = [value] if value else []
+    return [getattr(v, 'id', v.get('@id') if hasattr(v, 'get') else str(v)) for v in value]
+
+
+def _entity_types(entity):
+    types = getattr(entity, 'type', None) or []
+    return [types] if isinstance(types, str) else types
+
+
+class CrateIndex:
+    """
+    Lookups over the entities of a RO-Crate, indexed in a single pass.
+
+    Entities are indexed by id, by type, by top-level path prefix (e.g.
+    'datasets/') and by file extension, keeping crate order, so typed
+    queries cost O(1) or O(k) in the number of matching entities instead of
+    a scan of the whole graph. Entities need an id, a type and a get()
+    method (Entity records and ro-crate-py entities do).
+    """
+
+    def __init__(self, entities):
+        self.by_id = {}
+        self.by_type = defaultdict(list)
+        self.by_prefix = defaultdict(list)
+        self.by_extension = defaultdict(list)
+        self._position = {}
+        for position, entity in enumerate(entities):
+            entity_id = entity.id
+            self.by_id[entity_id] = entity
+            self._position[entity_id] = position
+            for entity_type in _entity_types(entity):
+                self.by_type[entity_type].append(entity)
+            if '/' in entity_id and not entity_id.startswith(('#', 'http://', 'https://')):
+                self.by_prefix[entity_id.split('/', 1)[0] + '/'].append(entity)
+            extension = os.path.splitext(entity_id)[1]
+            if extension:
+                self.by_extension[extension.lower()].append(entity)
+
+    def get(self, entity_id):
+        return self.by_id.get(entity_id)
+
+    def of_type(self, entity_type) -> list:
+        return self.by_type.get(entity_type, [])
+
+    def with_prefix(self, prefix) -> list:
+        return self.by_prefix.get(prefix, [])
+
+    def files(self, prefix=None, extensions=()) -> list:
+        """File entities with one of the extensions (and below prefix), in crate order."""
+        matches = [entity for extension in extensions for entity in self.by_extension.get(extension, [])
+                   if 'File' in _entity_types(entity)
+                   and (prefix is None or entity.id.startswith(prefix))]
+        return sorted(matches, key=lambda entity: self._position[entity.id])
+
+    def main_workflow(self):
+        """The Galaxy workflow of the crate (first ComputationalWorkflow stored as .gxwf.yml), or None."""
+        for entity in self.of_type('ComputationalWorkflow'):
+            if entity.id.endswith('.gxwf.yml'):
+                return entity
+        return None
+
+    def formal_parameters(self, workflow, prop) -> list:
+        """name/type/description of the FormalParameters listed in a workflow's input or output."""
+        parameters = []
+        for param_id in _entity_ids(workflow.get(prop, [])):
+            formal_param = self.get(param_id)
+            if formal_param:
+                parameters.append({
+                    'name': formal_param.get('name'),
+                    'type': formal_param.get('additionalType'),
+                    'description': formal_param.get('description', '')
+                })
+        return parameters
+
+
+def _file_info(entity):
+    return {
+        'name': entity.get('name'),
+        'path': entity.id,
+        'format': entity.get('encodingFormat'),
+        'size': entity.get('contentSize', 'Unknown')
+    }
+
+
+@instrumented("crate.load")
+def load_galaxy_crate(rocrate_path):
+    """
+    Load a Galaxy invocation RO-Crate and collect its rerun information.
+
+    ro-crate-metadata.json and the invocation file are read from the ZIP (or
+    extracted directory) without unpacking it, and each is parsed exactly
+    once; renderers (console, markdown, job file) work from the returned dict.
+
+    Args:
+        rocrate_path: Path to the RO-Crate ZIP file or extracted directory
+
+    Returns:
+        dict with workflow_name, formal_inputs, formal_outputs, state,
+        create_time, actual_parameters, workflow_parameters, input_files,
+        output_files, input_datasets, output_datasets and invocation_error
+    """
+    with open_galaxy_crate(rocrate_path) as crate:
+        index = CrateIndex(read_crate_metadata(crate))
+
+        # Parse invocation file for actual execution parameters
+        invocation_error = None
+        try:
+            with span("invocation.parse") as stage:
+                stage.add_bytes(crate.size('invocation_attrs.txt'))
+                with crate.open('invocation_attrs.txt') as f:
+                    invocation = read_invocation(f)
+        except Exception as e:
+            invocation_error = str(e)
+            invocation = parse_invocation({})
+
+    input_files = [_file_info(entity) for entity in index.files(DATASETS_PREFIX, INPUT_FILE_EXTENSIONS)]
+    output_files = [_file_info(entity) for entity in index.files(DATASETS_PREFIX, OUTPUT_FILE_EXTENSIONS)]
+
+    workflow_name = "Unknown"
+    formal_inputs = []
+    formal_outputs = []
+    main_workflow = index.main_workflow()
+    if main_workflow:
+        workflow_name = main_workflow.get('name', 'Unknown')
+        formal_inputs = index.formal_parameters(main_workflow, 'input')
+        formal_outputs = index.formal_parameters(main_workflow, 'output')
+
+    return {
+        'workflow_name': workflow_name,
+        'formal_inputs': formal_inputs,
+        'formal_outputs': formal_outputs,
+        'state': invocation['state'],
+        'create_time': invocation['create_time'],
+        'actual_parameters': invocation['actual_parameters'],
+        'workflow_parameters': invocation['workflow_parameters'],
+        'input_files': input_files,
+        'output_files': output_files,
+        'input_datasets': invocation['input_datasets'],
+        'output_datasets': invocation['output_datasets'],
+        'invocation_error': invocation_error
+    }
+
+
+def index_datasets(datasets, wanted_ids=None):
+    """
+    Build an encoded_id -> dataset record index in one pass over datasets_attrs.txt.
+
+    Args:
+        datasets: Iterable of dataset records, e.g. streaming_json.stream_datasets(f),
+                  which decodes each record in a single C-level raw_decode call
+        wanted_ids: Only index these encoded ids (None indexes every dataset)
+    """
+    if wanted_ids is None:
+        return {dataset["encoded_id"]: dataset for dataset in datasets if "encoded_id" in dataset}
+    return {encoded_id: dataset for dataset in datasets
+            if (encoded_id := dataset.get("encoded_id")) in wanted_ids}
+
+
+def resolve_datasets(dataset_index, dataset_refs):
+    """
+    Look up invocation dataset references in a dataset index.
+
+    Args:
+        dataset_index: dict returned by index_datasets
+        dataset_refs: input_datasets or output_datasets from parse_invocation
+
+    Returns:
+        (resolved, missing): resolved references sorted by their invocation
+        'order', each extended with the dataset 'file_name', and the
+        references that have no matching dataset
+    """
+    resolved = []
+    missing = []
+    for ref in dataset_refs:
+        dataset = dataset_index.get(ref['dataset_id'])
+        if dataset is None:
+            missing.append(ref)
+        else:
+            resolved.append({**ref, 'file_name': dataset["file_name"]})
+    resolved.sort(key=lambda ref: ref['order'])
+    return resolved, missing
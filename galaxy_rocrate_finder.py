@@ -5,9 +5,6 @@ Focuses on finding Galaxy workflows in RO-Crates from Zenodo and ROHub.
 Uses proper APIs and the ROHub Python package.
 """
 
-import requests
-import rdflib
-from rdflib import Namespace
 import json
 import re
 from urllib.parse import urljoin, urlparse
@@ -15,21 +12,29 @@ import sys
 from pathlib import Path
 import hashlib
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 import tempfile
 import zipfile
 import os
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from ROHubROCrateSearcher import ROHubIDExtractor, ROHubROCrateSearcher
+from uri_cache import DOI_TTL, OfflineCacheMiss, URICache
+from download_cache import ROCrateCache, sha256sum
+from instrumentation import configure as configure_profiling, instrumented, span
 
-# Import nanopub library
-from nanopub import Nanopub, NanopubConf
-
-# Import pooch for downloading files
-import pooch
+# requests, rdflib, nanopub and pooch are imported by the functions using them,
+# so that --help and cached runs do not pay for importing them
+if TYPE_CHECKING:
+    import requests
 
 # Define namespaces
-CITO = Namespace("http://purl.org/spar/cito/")
-NP = Namespace("http://www.nanopub.org/nschema#")
+CITO = "http://purl.org/spar/cito/"
+NP = "http://www.nanopub.org/nschema#"
+
+# Default number of DOIs resolved concurrently
+DOI_RESOLUTION_WORKERS = 8
 
 class WorkflowInfo:
     """Class to represent a found Galaxy workflow."""
@@ -51,13 +56,35 @@ class WorkflowInfo:
             **self.metadata
         }
 
-def fetch_nanopub(nanopub_uri):
-    """Fetch and parse a nanopublication using nanopub-py."""
+@instrumented("nanopub.fetch")
+def fetch_nanopub(nanopub_uri, cache: URICache = None):
+    """
+    Fetch and parse a nanopublication using nanopub-py.
+
+    Nanopubs are immutable (content-addressed by their trusty URI), so when a
+    cache is given they are served from it and fetched at most once.
+    """
+    import rdflib
+    from nanopub import Nanopub, NanopubConf
+
     try:
-        print(f"Fetching nanopub: {nanopub_uri}")
-        
         conf = NanopubConf()
+        
+        cached = cache.get('nanopub', nanopub_uri) if cache else None
+        if cached is not None:
+            print(f"Loading cached nanopub: {nanopub_uri}")
+            rdf = rdflib.ConjunctiveGraph()
+            rdf.parse(data=cached.decode('utf-8'), format='trig')
+            np = Nanopub(rdf=rdf, conf=conf)
+            print(f"✓ Successfully loaded nanopub from cache: {nanopub_uri}")
+            return np
+        if cache and cache.offline:
+            raise OfflineCacheMiss(f"{nanopub_uri} is not cached (offline mode)")
+        
+        print(f"Fetching nanopub: {nanopub_uri}")
         np = Nanopub(source_uri=nanopub_uri, conf=conf)
+        if cache:
+            cache.set('nanopub', nanopub_uri, np.rdf.serialize(format='trig'))
         
         print(f"✓ Successfully fetched nanopub: {np.source_uri}")
         return np
@@ -68,12 +95,15 @@ def fetch_nanopub(nanopub_uri):
 
 def find_supporting_dois(nanopub):
     """Find DOIs that support the nanopub using cito:obtainsSupportFrom."""
+    from rdflib import URIRef
+
+    obtains_support_from = URIRef(CITO + "obtainsSupportFrom")
     supporting_dois = []
     
     graphs_to_search = [nanopub.assertion, nanopub.provenance, nanopub.pubinfo]
     
     for graph in graphs_to_search:
-        for subj, pred, obj in graph.triples((None, CITO.obtainsSupportFrom, None)):
+        for subj, pred, obj in graph.triples((None, obtains_support_from, None)):
             doi_str = str(obj)
             if any(doi_str.startswith(prefix) for prefix in ['https://www.doi.org/', 'https://doi.org/', 'http://dx.doi.org/']):
                 supporting_dois.append(doi_str)
@@ -82,8 +112,30 @@ def find_supporting_dois(nanopub):
     
     return list(set(supporting_dois))
 
-def download_workflow_with_pooch(workflow_info: dict):
-    """Download a Galaxy workflow file using pooch."""
+WORKFLOW_DIR = './downloaded_workflows'
+# URL -> "sha256:<hex>" of the first verified download of each workflow
+WORKFLOW_HASHES = "workflow_hashes.json"
+
+
+def _pinned_hashes(path):
+    try:
+        with open(os.path.join(path, WORKFLOW_HASHES)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def download_workflow_with_pooch(workflow_info: dict, path: str = WORKFLOW_DIR):
+    """
+    Download a Galaxy workflow file using pooch, verified against its hash.
+
+    The hash is the "known_hash" of workflow_info (e.g. "sha256:<hex>") when
+    given, else the one pinned in <path>/workflow_hashes.json by the first
+    download of the same URL. pooch checks the local copy against it and
+    downloads again a copy that does not match.
+    """
+    import pooch
+
     try:
         url = workflow_info["url"]
         filename = workflow_info["filename"]
@@ -92,19 +144,29 @@ def download_workflow_with_pooch(workflow_info: dict):
         
         print(f"    Downloading {filename}...")
         
-        # Download the file directly
-        local_path = pooch.retrieve(
-            url=url,
-            known_hash=None,
-            fname=filename,
-            path='./downloaded_workflows'
-        )
+        hashes = _pinned_hashes(path)
+        known_hash = workflow_info.get("known_hash") or hashes.get(url)
+        with span("workflow.download", url=url) as stage:
+            local_path = pooch.retrieve(
+                url=url,
+                known_hash=known_hash,
+                fname=filename,
+                path=path
+            )
+            stage.add_bytes(os.path.getsize(local_path))
+
+        # Pin the hash so that later runs verify the local copy
+        pinned = known_hash or f"sha256:{sha256sum(local_path)}"
+        if hashes.get(url) != pinned:
+            hashes[url] = pinned
+            with open(os.path.join(path, WORKFLOW_HASHES), 'w') as f:
+                json.dump(hashes, f, indent=2)
 
         print(f"File downloaded to: {local_path}")
         return local_path
         
     except Exception as e:
-        print(f"    ✗ Error downloading {workflow_info["filename"]}: {e}")
+        print(f"    ✗ Error downloading {workflow_info['filename']}: {e}")
         return None
 
 def validate_galaxy_invocation_workflow(file_path):
@@ -156,20 +218,102 @@ def validate_galaxy_workflow(file_path):
         print(f"      ⚠ Error validating workflow: {e}")
         return False
 
+def resolve_doi(doi: str, session: "requests.Session" = None, timeout: float = 15, cache: URICache = None):
+    """
+    Follow the redirects of a DOI without downloading the landing page.
+
+    A HEAD request is tried first; servers that refuse HEAD get a streamed GET
+    whose body is never read. Successful resolutions are cached for DOI_TTL.
+
+    Returns:
+        dict with doi, url (final URL or None), status_code and error
+    """
+    result = {'doi': doi, 'url': None, 'status_code': None, 'error': None}
+    cached = cache.get('doi', doi) if cache else None
+    if cached is not None:
+        result['url'] = cached.decode('utf-8')
+        result['status_code'] = 200
+        return result
+    if cache and cache.offline:
+        result['error'] = f"{doi} is not cached (offline mode)"
+        return result
+    
+    if session is None:
+        import requests
+        session = requests.Session()
+    try:
+        response = session.head(doi, timeout=timeout, allow_redirects=True)
+        if response.status_code >= 400:
+            response = session.get(doi, timeout=timeout, allow_redirects=True, stream=True)
+            response.close()
+        result['status_code'] = response.status_code
+        if response.status_code == 200:
+            result['url'] = response.url
+            if cache:
+                cache.set('doi', doi, response.url, ttl=DOI_TTL)
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+_thread_local = threading.local()
+
+
+def _thread_session() -> "requests.Session":
+    """requests sessions are not thread-safe, so each worker thread gets its own."""
+    if not hasattr(_thread_local, 'session'):
+        import requests
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+
+@instrumented("doi.resolve")
+def resolve_dois(dois: List[str], max_workers: int = DOI_RESOLUTION_WORKERS, timeout: float = 15,
+                 cache: URICache = None) -> List[Dict[str, Any]]:
+    """
+    Resolve several DOIs concurrently with a bounded thread pool.
+
+    Args:
+        dois: DOI URLs to resolve
+        max_workers: Maximum number of DOIs resolved at the same time
+        timeout: Per-request timeout in seconds
+        cache: Optional URICache for DOI resolutions
+
+    Returns:
+        List of resolve_doi results, in the order of dois
+    """
+    if not dois:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(dois)))) as executor:
+        return list(executor.map(lambda doi: resolve_doi(doi, _thread_session(), timeout, cache), dois))
+
 def main():
     """Main function."""
-    if len(sys.argv) != 3:
-        print("Usage: python rocrate_galaxy_finder.py <nanopub_uri> <output_dir>")
-        print("Example: python rocrate_galaxy_finder.py https://w3id.org/np/RAnqaMx3Ri3bR8yY3oiM-BeMJf8LPxidTSqyEpcHyXoLc downloaded_rocrate")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Find and download the Galaxy RO-Crates supporting a nanopublication",
+        epilog="Example: python galaxy_rocrate_finder.py https://w3id.org/np/RAnqaMx3Ri3bR8yY3oiM-BeMJf8LPxidTSqyEpcHyXoLc downloaded_rocrate")
+    parser.add_argument("nanopub_uri", help="URI of the nanopublication")
+    parser.add_argument("output_dir", help="Directory receiving the downloaded RO-Crates")
+    parser.add_argument("--concurrency", type=int, default=DOI_RESOLUTION_WORKERS,
+                        help=f"Maximum number of DOIs resolved concurrently (default: {DOI_RESOLUTION_WORKERS})")
+    parser.add_argument("--cache", default=None,
+                        help="Nanopub/DOI cache file (default: $WARMING_STRIPES_CACHE or ~/.cache/warming-stripes/uri_cache.sqlite)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the nanopub/DOI/RO-Crate caches")
+    parser.add_argument("--rocrate-cache", default=None,
+                        help="RO-Crate download cache directory (default: $WARMING_STRIPES_ROCRATE_CACHE or ~/.cache/warming-stripes/rocrates)")
+    parser.add_argument("--offline", action="store_true", default=None,
+                        help="Only use cached nanopubs and DOI resolutions (also $WARMING_STRIPES_OFFLINE=1)")
+    parser.add_argument("--profile", default=None,
+                        help="Append per-stage timing spans (JSON lines) to this file, '-' for stderr "
+                             "(also $WARMING_STRIPES_PROFILE)")
+    args = parser.parse_args()
+    if args.offline and args.no_cache:
+        parser.error("--offline needs the caches: it cannot be combined with --no-cache")
+    configure_profiling(args.profile)
     
-    nanopub_uri = sys.argv[1]
-    output_dir = sys.argv[2]
+    nanopub_uri = args.nanopub_uri
+    output_dir = args.output_dir
 
-    # Initialize components
-    session = requests.Session()
-    
-    
     # Initialize ROHub
     # Check if HOME environment variable exists
     if 'HOME' in os.environ:
@@ -180,8 +324,11 @@ def main():
     rohub_user = open(home_dir + "/rohub-user").read().rstrip()
     rohub_pwd = open(home_dir + "/rohub-pwd").read().rstrip()
 
+    cache = None if args.no_cache else URICache(args.cache, offline=args.offline)
+    rocrate_cache = None if args.no_cache else ROCrateCache(args.rocrate_cache)
+
     # Fetch nanopub
-    nanopub = fetch_nanopub(nanopub_uri)
+    nanopub = fetch_nanopub(nanopub_uri, cache)
     if not nanopub:
         print("Failed to fetch nanopublication")
         return
@@ -202,33 +349,41 @@ def main():
     for doi in supporting_dois:
         print(f"  • {doi}")
     
+    # Follow all DOI redirects concurrently
+    resolutions = resolve_dois(supporting_dois, max_workers=args.concurrency, cache=cache)
+    
+    # One searcher for all research objects: ROHub login happens once, on first download
+    searcher = ROHubROCrateSearcher(username=rohub_user, password=rohub_pwd)
+    extractor = ROHubIDExtractor()
+    rohub_ids = []
+    
     # Search for workflows in each DOI
-    for doi in supporting_dois:
+    for resolution in resolutions:
+        doi = resolution['doi']
         print(f"\nAnalyzing DOI: {doi}")
         
-        # Follow DOI redirect
-        try:
-            response = session.get(doi, timeout=15, allow_redirects=True)
-            if response.status_code == 200:
-                final_url = response.url
-                print(f"  Resolved to: {final_url}")
-                
-                # Find appropriate searcher - here rohub only
-                if 'rohub.org' in final_url:
-                    extractor = ROHubIDExtractor()
-                    rohub_id = extractor.extract_id(final_url)
-
-                    # Initialize searcher
-                    searcher = ROHubROCrateSearcher()
-                    searcher.authenticate_rohub(username=rohub_user, password=rohub_pwd)
-                    print(f"Analyzing ROHub Research Object: {rohub_id}")
-                    # Download RO-Crate
-                    searcher.download_rocrate(rohub_id, output_dir)
-            else:
-                print(f"  ✗ Failed to resolve DOI: {response.status_code}")
-                
-        except Exception as e:
-            print(f"  ✗ Error resolving DOI: {e}")
+        if resolution['error']:
+            print(f"  ✗ Error resolving DOI: {resolution['error']}")
+            continue
+        if not resolution['url']:
+            print(f"  ✗ Failed to resolve DOI: {resolution['status_code']}")
+            continue
+        
+        final_url = resolution['url']
+        print(f"  Resolved to: {final_url}")
+        
+        # Find appropriate searcher - here rohub only
+        if 'rohub.org' in final_url:
+            rohub_id = extractor.extract_id(final_url)
+            print(f"Analyzing ROHub Research Object: {rohub_id}")
+            rohub_ids.append(rohub_id)
+    
+    # Download the RO-Crates concurrently, sharing the authenticated searcher
+    if rohub_ids:
+        with ThreadPoolExecutor(max_workers=max(1, min(args.concurrency, len(rohub_ids)))) as executor:
+            offline = bool(cache and cache.offline)
+            list(executor.map(lambda rohub_id: searcher.download_rocrate(rohub_id, output_dir, rocrate_cache, offline),
+                              rohub_ids))
     
 
 if __name__ == "__main__":
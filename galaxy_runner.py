@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Helpers to run Galaxy workflows with BioBlend
+Used by bioblend_workflow.py: uploading inputs, waiting for workflow
+invocations to complete and downloading invocation archives. Also runs parameter sweeps (many invocations of one
+workflow) from the command line:
+
+    python galaxy_runner.py sweep.json --galaxy_url https://usegalaxy.eu
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from download_cache import download_file, sha256sum
+from instrumentation import configure as configure_profiling, instrumented, span
+
+# Job states of a finished invocation
+JOB_OK_STATES = {'ok', 'skipped'}
+# Job states that make the invocation fail ('paused' = waiting on a failed upstream job)
+JOB_ERROR_STATES = {'error', 'failed', 'deleted', 'deleting', 'paused'}
+# Invocation scheduling states
+INVOCATION_SCHEDULED_STATE = 'scheduled'
+INVOCATION_ERROR_STATES = {'failed', 'cancelled', 'cancelling'}
+# populated_state of a job state summary whose jobs are still being created
+SUMMARY_POPULATING_STATE = 'new'
+
+# Upload chunk size; BioBlend sends files to Galaxy with the resumable TUS protocol
+UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+UPLOAD_WORKERS = 4
+# Buffer size used to download invocation archives
+ARCHIVE_CHUNK_SIZE = 8 * 1024 * 1024
+# Maximum number of sweep invocations submitted/awaited at the same time
+SWEEP_WORKERS = 8
+# Tag prefix recording the content hash of uploaded datasets
+HASH_TAG_PREFIX = 'sha256:'
+
+
+class InvocationError(Exception):
+    """Raised when a workflow invocation fails or one of its jobs errors."""
+
+
+def poll_delays(timeout, initial_interval=2, max_interval=60, backoff=2, jitter=0.2):
+    """
+    Delays to wait before each poll of a status, with exponential backoff and jitter.
+
+    The first delay is 0; the clock starts at the first delay. Each delay is
+    interval +/- jitter, never past the deadline, and the interval is
+    multiplied by backoff (up to max_interval) after each poll. Shared by the
+    blocking and asyncio waits.
+
+    Args:
+        timeout: Time after which no more polls are scheduled, in seconds
+        initial_interval: Delay before the second poll, in seconds
+        max_interval: Upper bound of the interval, in seconds
+        backoff: Factor applied to the interval after each poll
+        jitter: Relative random variation of each delay
+
+    Yields:
+        Seconds to wait before the next poll; the generator ends at the deadline
+    """
+    deadline = time.monotonic() + timeout
+    yield 0.0
+    interval = initial_interval
+    while time.monotonic() < deadline:
+        delay = interval * random.uniform(1 - jitter, 1 + jitter)
+        yield max(0.0, min(delay, deadline - time.monotonic()))
+        interval = min(interval * backoff, max_interval)
+
+
+def poll_invocation(gi, invocation_id, scheduled=False):
+    """
+    Check a workflow invocation once (one call of wait_for_invocation's loop).
+
+    Args:
+        gi: bioblend.galaxy.GalaxyInstance
+        invocation_id: Id of the workflow invocation
+        scheduled: Whether the invocation was already seen scheduled (its state is then not fetched again)
+
+    Returns:
+        tuple (scheduled, states, summary): states maps job states to counts;
+        summary is the final job state summary once the invocation is complete, else None
+
+    Raises:
+        InvocationError: if the invocation or one of its jobs failed
+    """
+    if not scheduled:
+        state = gi.invocations.show_invocation(invocation_id)['state']
+        if state in INVOCATION_ERROR_STATES:
+            raise InvocationError(f"Invocation {invocation_id} is {state}")
+        scheduled = state == INVOCATION_SCHEDULED_STATE
+
+    summary = gi.invocations.get_invocation_summary(invocation_id)
+    states = {state: count for state, count in summary.get('states', {}).items() if count}
+    errors = {state: count for state, count in states.items() if state in JOB_ERROR_STATES}
+    if errors:
+        raise InvocationError(f"Invocation {invocation_id} has failed jobs: {errors}")
+    # A scheduled invocation whose jobs are all created may have no job at all
+    populated = summary.get('populated_state', 'ok') != SUMMARY_POPULATING_STATE
+    complete = scheduled and populated and set(states) <= JOB_OK_STATES
+    return scheduled, states, summary if complete else None
+
+
+@instrumented("galaxy.invocation_wait")
+def wait_for_invocation(gi, invocation_id, timeout=3600, initial_interval=2, max_interval=60,
+                        backoff=2, jitter=0.2, verbose=True):
+    """
+    Wait for a workflow invocation to be scheduled and all its jobs to finish.
+
+    Only the invocation and its job state summary are polled (never the
+    history contents), with exponential backoff and jitter between polls.
+
+    Args:
+        gi: bioblend.galaxy.GalaxyInstance
+        invocation_id: Id of the workflow invocation
+        timeout: Maximum time to wait, in seconds
+        initial_interval: First delay between polls, in seconds
+        max_interval: Upper bound of the delay between polls, in seconds
+        backoff: Factor applied to the delay after each poll
+        jitter: Relative random variation of each delay
+        verbose: Print progress
+
+    Returns:
+        dict: Final job state summary ({'states': {state: count}, ...})
+
+    Raises:
+        InvocationError: as soon as the invocation or one of its jobs fails
+        TimeoutError: if the invocation is not complete after timeout seconds
+    """
+    scheduled = False
+    states = {}
+    for delay in poll_delays(timeout, initial_interval, max_interval, backoff, jitter):
+        if delay:
+            if verbose:
+                print(f"⏳ Waiting for workflow to complete... (jobs: {states or 'none yet'})")
+            time.sleep(delay)
+        scheduled, states, summary = poll_invocation(gi, invocation_id, scheduled)
+        if summary is not None:
+            return summary
+    raise TimeoutError(f"Invocation {invocation_id} not complete after {timeout} s (jobs: {states})")
+
+
+def _datasets_by_hash(gi, history_id):
+    """Map content hash -> dataset for the datasets of a history tagged by upload_to_history."""
+    datasets = {}
+    for dataset in gi.histories.show_history(history_id, contents=True, deleted=False):
+        if dataset.get('state') in JOB_ERROR_STATES:
+            continue
+        for tag in dataset.get('tags') or []:
+            if tag.startswith(HASH_TAG_PREFIX):
+                datasets[tag[len(HASH_TAG_PREFIX):]] = dataset
+    return datasets
+
+
+def find_uploaded_dataset(gi, sha256):
+    """Return a dataset of any of the user's histories tagged with sha256 by upload_to_history, or None."""
+    for dataset in gi.datasets.get_datasets(tag=HASH_TAG_PREFIX + sha256, state='ok', deleted=False, limit=1):
+        return dataset
+    return None
+
+
+def upload_to_history(inputs, gi, hist_id, max_workers=UPLOAD_WORKERS, chunk_size=UPLOAD_CHUNK_SIZE,
+                      resume_storage=None, search_all_histories=False):
+    """
+    Upload input files to a Galaxy history concurrently.
+
+    Each file is sent in chunks with the TUS protocol (resumable when
+    resume_storage is given) and tagged with its SHA-256. Files whose hash is
+    already tagged on a dataset of the history are not uploaded again. With
+    search_all_histories, a file uploaded to another history is copied from
+    there instead: the copy shares the original dataset, so Galaxy's job
+    cache (use_cached_job) recognises the jobs that already consumed it.
+
+    Args:
+        inputs: Paths of the files to upload
+        gi: bioblend.galaxy.GalaxyInstance
+        hist_id: Id of the target history
+        max_workers: Maximum number of concurrent uploads
+        chunk_size: TUS chunk size, in bytes
+        resume_storage: File where TUS upload URLs are kept to resume interrupted uploads
+        search_all_histories: Look for already uploaded files in all the user's histories
+
+    Returns:
+        list: One upload result per input, in order; for skipped files a
+        result holding the existing (or copied) dataset in 'outputs'
+    """
+    if not inputs:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(inputs)))) as executor:
+        hashes = list(executor.map(sha256sum, inputs))
+        existing = _datasets_by_hash(gi, hist_id)
+
+        def upload(input_filename, sha256):
+            if sha256 in existing:
+                print(f"✓ {input_filename} already in history (dataset {existing[sha256]['id']})")
+                return {'outputs': [existing[sha256]], 'skipped': True}
+            if search_all_histories:
+                uploaded = find_uploaded_dataset(gi, sha256)
+                if uploaded is not None:
+                    hda = gi.histories.copy_dataset(hist_id, uploaded['id'])
+                    print(f"✓ {input_filename} copied from history {uploaded.get('history_id')} "
+                          f"(dataset {uploaded['id']})")
+                    return {'outputs': [hda], 'skipped': True, 'copied_from': uploaded['id']}
+            print(f"Uploading {input_filename} ({os.path.getsize(input_filename)} bytes)")
+            with span("galaxy.upload", file=input_filename) as stage:
+                ret = gi.tools.upload_file(input_filename, hist_id, chunk_size=chunk_size, storage=resume_storage)
+                stage.add_bytes(os.path.getsize(input_filename))
+            for hda in ret['outputs']:
+                gi.histories.update_dataset(hist_id, hda['id'], tags=[HASH_TAG_PREFIX + sha256])
+            return ret
+
+        # Identical files listed several times are uploaded once
+        first_inputs = {}
+        for input_filename, sha256 in zip(inputs, hashes):
+            first_inputs.setdefault(sha256, input_filename)
+        uploads = dict(zip(first_inputs, executor.map(upload, first_inputs.values(), first_inputs)))
+        return [uploads[sha256] for sha256 in hashes]
+
+
+@instrumented("galaxy.archive_download")
+def download_invocation_archive(gi, invocation_id, path, model_store_format="rocrate.zip",
+                                max_wait=3600, chunk_size=ARCHIVE_CHUNK_SIZE, retries=5):
+    """
+    Export a workflow invocation and download the archive.
+
+    Galaxy prepares the export asynchronously in short-term storage; its
+    readiness is polled with backoff, so large archives do not hit request
+    timeouts. The download resumes with Range requests when interrupted, is
+    checked against the announced size and, for ZIP formats, against the ZIP
+    central directory. Throughput is reported at the end.
+
+    Args:
+        gi: bioblend.galaxy.GalaxyInstance
+        invocation_id: Id of the workflow invocation
+        path: Destination file (e.g. climate.rocrate.zip)
+        model_store_format: Galaxy export format ('rocrate.zip', 'tgz', ...)
+        max_wait: Maximum time to wait for the export, in seconds
+        chunk_size: Download buffer size, in bytes
+        retries: Number of attempts resuming an interrupted download
+
+    Returns:
+        path
+    """
+    prepared = gi.make_post_request(f"{gi.url}/invocations/{invocation_id}/prepare_store_download",
+                                    payload={"model_store_format": model_store_format})
+    storage_url = f"{gi.url}/short_term_storage/{prepared['storage_request_id']}"
+
+    for delay in poll_delays(max_wait, initial_interval=1, max_interval=30):
+        if delay:
+            print(f"⏳ Waiting for Galaxy to prepare the {model_store_format} archive...")
+            time.sleep(delay)
+        if gi.make_get_request(f"{storage_url}/ready").json():
+            break
+    else:
+        raise TimeoutError(f"Archive of invocation {invocation_id} not ready after {max_wait} s")
+
+    return download_file(storage_url, path, headers={"x-api-key": gi.key},
+                         is_zip=model_store_format.endswith("zip"), chunk_size=chunk_size,
+                         retries=retries, verbose=True)
+
+
+def _set_param(params, dotted_key, value):
+    """Set params['a']['b'] for dotted_key 'a.b', creating nested dicts as needed."""
+    keys = dotted_key.split('.')
+    for key in keys[:-1]:
+        params = params.setdefault(key, {})
+    params[keys[-1]] = value
+
+
+def expand_parameter_sets(grid=None, runs=None):
+    """
+    Build the list of parameter sets of a sweep.
+
+    Args:
+        grid: dict of parameter -> list of values; every combination is a run
+        runs: list of explicit parameter sets (dicts), appended after the grid
+
+    Parameters are tool parameters of the workflow step, with dotted keys for
+    nested ones (e.g. 'adv.colormap'); the key 'input' is the input file.
+
+    Returns:
+        list of dict
+    """
+    parameter_sets = []
+    if grid:
+        keys = list(grid)
+        for values in itertools.product(*(grid[key] for key in keys)):
+            parameter_sets.append(dict(zip(keys, values)))
+    parameter_sets.extend(runs or [])
+    return parameter_sets
+
+
+def _step_params(base_params, parameter_set):
+    params = copy.deepcopy(base_params or {})
+    for key, value in parameter_set.items():
+        if key != 'input':
+            _set_param(params, key, value)
+    return params
+
+
+def run_sweep(gi, workflow_path, parameter_sets, base_params=None, step=1, input_step=0,
+              history_name='ScienceLive-sweep', max_workers=SWEEP_WORKERS, timeout=6 * 3600,
+              use_cached_job=False):
+    """
+    Run one workflow for many parameter sets.
+
+    The workflow is imported once, every distinct input file is uploaded once
+    into a shared history, and the invocations are submitted and awaited
+    concurrently by a bounded thread pool.
+
+    Args:
+        gi: bioblend.galaxy.GalaxyInstance
+        workflow_path: Galaxy workflow file (.ga)
+        parameter_sets: list of dicts from expand_parameter_sets; each needs an 'input'
+        base_params: Tool parameters of the step shared by all runs
+        step: Index of the workflow step receiving the parameters
+        input_step: Index of the workflow input step receiving the input file
+        history_name: Name of the history created for the sweep
+        max_workers: Maximum number of invocations in flight
+        timeout: Per-invocation timeout, in seconds
+        use_cached_job: Let Galaxy reuse identical jobs that already ran
+
+    Yields:
+        dict with parameters, invocation_id, status ('ok' or 'failed'), error
+        and seconds, in completion order
+    """
+    workflow_id = gi.workflows.import_workflow_from_local_path(workflow_path)["id"]
+    history_id = gi.histories.create_history(name=history_name)["id"]
+
+    input_files = list(dict.fromkeys(parameter_set['input'] for parameter_set in parameter_sets))
+    uploads = upload_to_history(input_files, gi, history_id)
+    input_datasets = {input_file: ret['outputs'][0]['id'] for input_file, ret in zip(input_files, uploads)}
+
+    def invoke_and_wait(parameter_set):
+        start = time.monotonic()
+        result = {'parameters': parameter_set, 'invocation_id': None, 'status': 'ok', 'error': None}
+        try:
+            inputs = {str(input_step): {'id': input_datasets[parameter_set['input']], 'src': 'hda'}}
+            params = {str(step): _step_params(base_params, parameter_set)}
+            with span("galaxy.invoke"):
+                invocation = gi.workflows.invoke_workflow(workflow_id, inputs=inputs, params=params,
+                                                          history_id=history_id, use_cached_job=use_cached_job)
+            result['invocation_id'] = invocation['id']
+            wait_for_invocation(gi, invocation['id'], timeout=timeout, verbose=False)
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        result['seconds'] = round(time.monotonic() - start, 3)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(invoke_and_wait, parameter_set) for parameter_set in parameter_sets]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a Galaxy workflow for many parameter sets",
+        epilog="Sweep file (JSON): {\"workflow\": \"workflow.ga\", \"step\": 1, \"base_params\": {...}, "
+               "\"grid\": {\"input\": [...], \"variable\": [...], \"adv.colormap\": [...]}, \"runs\": [...]}")
+    parser.add_argument("sweep_file", help="JSON file describing the sweep")
+    parser.add_argument("--galaxy_url", default="https://usegalaxy.eu/", help="Galaxy server")
+    parser.add_argument("--history_name", default="ScienceLive-sweep", help="Name of the history created for the sweep")
+    parser.add_argument("--concurrency", type=int, default=SWEEP_WORKERS, help="Maximum number of invocations in flight")
+    parser.add_argument("--results", default="sweep_results.jsonl", help="File receiving one JSON result per run")
+    parser.add_argument("--profile", default=None,
+                        help="Append per-stage timing spans (JSON lines) to this file, '-' for stderr "
+                             "(also $WARMING_STRIPES_PROFILE)")
+    args = parser.parse_args()
+    configure_profiling(args.profile)
+
+    api_key = os.environ.get("GALAXY_API_KEY")
+    if not api_key:
+        print("Error: GALAXY_API_KEY environment variable not set")
+        sys.exit(1)
+
+    with open(args.sweep_file) as f:
+        sweep = json.load(f)
+    parameter_sets = expand_parameter_sets(sweep.get("grid"), sweep.get("runs"))
+    print(f"Running {len(parameter_sets)} invocations of {sweep['workflow']}")
+
+    import bioblend.galaxy
+    gi = bioblend.galaxy.GalaxyInstance(url=args.galaxy_url, key=api_key)
+
+    failures = 0
+    with open(args.results, 'w') as results:
+        for result in run_sweep(gi, sweep["workflow"], parameter_sets, sweep.get("base_params"),
+                                step=sweep.get("step", 1), input_step=sweep.get("input_step", 0),
+                                history_name=args.history_name, max_workers=args.concurrency):
+            mark = "✓" if result['status'] == 'ok' else "✗"
+            print(f"{mark} {result['invocation_id']} {result['parameters']} ({result['seconds']:.0f} s)")
+            failures += result['status'] != 'ok'
+            results.write(json.dumps(result) + "\n")
+            results.flush()
+    print(f"{len(parameter_sets) - failures} succeeded, {failures} failed; results in {args.results}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Incremental rerun of a prepared Galaxy workflow
+prepare_inputs_and_parameters.py records what the source invocation ran with
+(job file parameters, size and modification time of each input dataset,
+actual step parameters and output datasets) in a baseline next to the job
+file. Before rerunning, the edited job file is diffed against it; an input is
+only hashed when its size or modification time changed:
+- nothing changed: the outputs of the source crate (or of the last rerun)
+  are reused and Galaxy is not called;
+- otherwise unchanged inputs are copied from an earlier upload instead of
+  uploaded again, and the workflow is invoked with Galaxy's job cache
+  (use_cached_job), so the steps whose inputs did not change are not run again.
+
+    python incremental_rerun.py workflow.ga workflow_input_params.yml --galaxy_url https://usegalaxy.eu
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import yaml
+
+from download_cache import sha256sum
+from galaxy_rocrate import open_galaxy_crate
+from galaxy_runner import upload_to_history, wait_for_invocation
+from instrumentation import configure as configure_profiling, instrumented, span
+
+BASELINE_SUFFIX = ".baseline.json"
+
+
+def baseline_filename(job_filename):
+    """Baseline of a job file: workflow_input_params.yml -> workflow_input_params.baseline.json"""
+    return os.path.splitext(job_filename)[0] + BASELINE_SUFFIX
+
+
+def _is_file(value):
+    return isinstance(value, dict) and value.get('class') == 'File'
+
+
+def job_parameters(job):
+    """Non-file entries of a job file (workflow parameter inputs)."""
+    return {key: value for key, value in job.items() if not _is_file(value)}
+
+
+def job_inputs(job):
+    """File entries of a job file: input label -> path."""
+    return {key: value['path'] for key, value in job.items() if _is_file(value)}
+
+
+def _input_record(path, sha256=None):
+    """Baseline entry of an input file: absolute path, size, mtime and the SHA-256 if known."""
+    stat = os.stat(path)
+    record = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if sha256:
+        record['sha256'] = sha256
+    return record
+
+
+def make_baseline(job, rocrate=None, actual_parameters=None, output_files=(), invocation_id=None,
+                  input_hashes=None):
+    """
+    Describe what a job file was run with.
+
+    Args:
+        job: Loaded job file
+        rocrate: Source RO-Crate (its outputs are reused when nothing changes)
+        actual_parameters: Step parameters recorded in the crate's invocation_attrs.txt
+        output_files: Crate members holding the invocation outputs
+        invocation_id: Galaxy invocation that ran the job, for reruns
+        input_hashes: Input label -> SHA-256, when already known. Inputs are
+                      not hashed here: unknown hashes are computed by diff_job,
+                      and only for inputs whose size or mtime changed
+
+    Returns:
+        dict: JSON-serializable baseline
+    """
+    input_hashes = input_hashes or {}
+    return {
+        'rocrate': os.path.abspath(rocrate) if rocrate else None,
+        'invocation_id': invocation_id,
+        'parameters': job_parameters(job),
+        'inputs': {key: _input_record(path, input_hashes.get(key))
+                   for key, path in job_inputs(job).items()},
+        'actual_parameters': actual_parameters or {},
+        'output_files': list(output_files),
+    }
+
+
+def _rebase_inputs(baseline, convert):
+    inputs = {key: dict(record, path=convert(record['path']))
+              for key, record in baseline.get('inputs', {}).items()}
+    return dict(baseline, inputs=inputs)
+
+
+def write_baseline(filename, baseline):
+    """Write a baseline; input paths are stored relative to its directory, so the output directory can move."""
+    base_dir = os.path.dirname(os.path.abspath(filename))
+    baseline = _rebase_inputs(baseline, lambda path: os.path.relpath(os.path.abspath(path), base_dir))
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'w') as f:
+        json.dump(baseline, f, indent=2, default=str)
+    os.replace(tmp_filename, filename)
+
+
+def read_baseline(filename):
+    """Read a baseline; input paths are returned as absolute paths."""
+    base_dir = os.path.dirname(os.path.abspath(filename))
+    with open(filename) as f:
+        baseline = json.load(f)
+    return _rebase_inputs(baseline, lambda path: os.path.normpath(os.path.join(base_dir, path)))
+
+
+def _input_hash(path, record):
+    """
+    SHA-256 of an input if it is unchanged since its baseline record or must be hashed.
+
+    Returns:
+        tuple (changed, sha256): sha256 is None when it was not needed
+    """
+    if not record:
+        return True, None
+    stat = os.stat(path)
+    if (os.path.abspath(path) == record['path'] and stat.st_size == record.get('size')
+            and stat.st_mtime_ns == record.get('mtime_ns')):
+        return False, record.get('sha256')
+    # Touched, or another file: only its content tells, if the baseline has a hash to compare
+    if not record.get('sha256') or stat.st_size != record.get('size', stat.st_size):
+        return True, None
+    sha256 = sha256sum(path)
+    return sha256 != record['sha256'], sha256
+
+
+@instrumented("rerun.diff")
+def diff_job(job, baseline):
+    """
+    Compare a job file with the baseline it was prepared from.
+
+    Inputs whose path, size and modification time match the baseline are
+    unchanged without being read; others are hashed only when the baseline
+    has a SHA-256 to compare with.
+
+    Returns:
+        dict with the changed_parameters, changed_inputs and unchanged_inputs
+        (input labels) and the input_hashes known so far
+    """
+    parameters = job_parameters(job)
+    baseline_parameters = baseline.get('parameters', {})
+    changed_parameters = sorted(key for key in set(parameters) | set(baseline_parameters)
+                                if parameters.get(key) != baseline_parameters.get(key))
+
+    inputs = job_inputs(job)
+    baseline_inputs = baseline.get('inputs', {})
+    changed_inputs = {key for key in baseline_inputs if key not in inputs}
+    input_hashes = {}
+    for key, path in inputs.items():
+        changed, sha256 = _input_hash(path, baseline_inputs.get(key))
+        if changed:
+            changed_inputs.add(key)
+        if sha256:
+            input_hashes[key] = sha256
+    changed_inputs = sorted(changed_inputs)
+    unchanged_inputs = sorted(key for key in inputs if key not in changed_inputs)
+    return {'changed_parameters': changed_parameters, 'changed_inputs': changed_inputs,
+            'unchanged_inputs': unchanged_inputs, 'input_hashes': input_hashes}
+
+
+def read_job(job_filename):
+    """Load a job file and the baseline recorded next to it; returns (job, baseline)."""
+    with open(job_filename) as f:
+        job = yaml.safe_load(f)
+    return job, read_baseline(baseline_filename(job_filename))
+
+
+def is_unchanged(diff):
+    """Whether a diff_job result has neither changed parameters nor changed inputs."""
+    return not diff['changed_parameters'] and not diff['changed_inputs']
+
+
+def reuse_outputs(baseline, output_dir):
+    """Point to (or extract) the outputs of the run described by baseline."""
+    if baseline.get('invocation_id'):
+        print(f"✓ Outputs of invocation {baseline['invocation_id']} are reused")
+        return []
+    if baseline.get('rocrate') and baseline.get('output_files'):
+        with open_galaxy_crate(baseline['rocrate']) as crate:
+            paths = crate.extract(baseline['output_files'], output_dir)
+        for path in paths:
+            print(f"✓ Reused output: {path}")
+        return paths
+    print("✓ Nothing to rerun (no recorded outputs to reuse)")
+    return []
+
+
+def upload_inputs(gi, job, history_id):
+    """
+    Upload the input files of a job file to a history.
+
+    Inputs uploaded before (to any history) are copied rather than uploaded
+    as new datasets, so Galaxy's job cache can match them.
+
+    Returns:
+        dict: Workflow inputs by label (uploaded datasets and job file parameters)
+    """
+    input_paths = job_inputs(job)
+    uploads = upload_to_history(list(input_paths.values()), gi, history_id, search_all_histories=True)
+    inputs = {key: {'id': ret['outputs'][0]['id'], 'src': 'hda'} for key, ret in zip(input_paths, uploads)}
+    inputs.update(job_parameters(job))
+    return inputs
+
+
+def invoke_with_job_cache(gi, workflow_id, history_id, inputs):
+    """
+    Invoke a workflow with inputs given by label, reusing Galaxy's cached jobs.
+
+    Galaxy only reuses jobs whose tool, parameters and input datasets all
+    match, so the cache is safe to enable for the whole invocation.
+
+    Returns:
+        dict: The invocation
+    """
+    with span("galaxy.invoke"):
+        return gi.workflows.invoke_workflow(workflow_id, inputs=inputs, history_id=history_id,
+                                            inputs_by='name', use_cached_job=True)
+
+
+def record_rerun(job_filename, job, baseline, diff, invocation_id):
+    """Update the baseline of a job file to a completed rerun, so the next rerun is diffed against it."""
+    write_baseline(baseline_filename(job_filename),
+                   make_baseline(job, baseline.get('rocrate'), baseline.get('actual_parameters'),
+                                 baseline.get('output_files'), invocation_id, diff['input_hashes']))
+
+
+def rerun(gi, workflow_path, job_filename, output_dir='.', history_name='ScienceLive-rerun',
+          timeout=6 * 3600, force=False):
+    """
+    Rerun a workflow for an edited job file, executing only what changed.
+
+    Job file entries are passed to the workflow inputs of the same label.
+    On success the baseline is updated to the new invocation, so the next
+    rerun is diffed against it.
+
+    Args:
+        gi: bioblend.galaxy.GalaxyInstance (may be None if nothing changed)
+        workflow_path: Galaxy workflow file (.ga)
+        job_filename: Job file written by prepare_inputs_and_parameters.py, possibly edited
+        output_dir: Where crate outputs are extracted when nothing changed
+        history_name: Name of the history created for the rerun
+        timeout: Invocation timeout, in seconds
+        force: Invoke the workflow even if nothing changed
+
+    Returns:
+        dict with status ('unchanged' or 'ok'), invocation_id, the diff and seconds
+    """
+    start = time.monotonic()
+    job, baseline = read_job(job_filename)
+    diff = diff_job(job, baseline)
+
+    print(f"Changed parameters: {', '.join(diff['changed_parameters']) or 'none'}")
+    print(f"Changed inputs: {', '.join(diff['changed_inputs']) or 'none'}")
+    if is_unchanged(diff) and not force:
+        reuse_outputs(baseline, output_dir)
+        return {'status': 'unchanged', 'invocation_id': baseline.get('invocation_id'), 'diff': diff,
+                'seconds': round(time.monotonic() - start, 3)}
+
+    if gi is None:
+        raise ValueError("GALAXY_API_KEY environment variable not set")
+    workflow_id = gi.workflows.import_workflow_from_local_path(workflow_path)["id"]
+    history_id = gi.histories.create_history(name=history_name)["id"]
+    inputs = upload_inputs(gi, job, history_id)
+    invocation = invoke_with_job_cache(gi, workflow_id, history_id, inputs)
+    wait_for_invocation(gi, invocation['id'], timeout=timeout)
+
+    record_rerun(job_filename, job, baseline, diff, invocation['id'])
+    return {'status': 'ok', 'invocation_id': invocation['id'], 'diff': diff,
+            'seconds': round(time.monotonic() - start, 3)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rerun a prepared Galaxy workflow, executing only the steps whose inputs changed",
+        epilog="Example: python incremental_rerun.py workflow.ga workflow_input_params.yml")
+    parser.add_argument("workflow", help="Galaxy workflow file (.ga)")
+    parser.add_argument("job_file", help="Job file written by prepare_inputs_and_parameters.py")
+    parser.add_argument("--galaxy_url", default="https://usegalaxy.eu/", help="Galaxy server")
+    parser.add_argument("--history_name", default="ScienceLive-rerun", help="Name of the history created for the rerun")
+    parser.add_argument("--output_dir", default=".", help="Where reused crate outputs are extracted")
+    parser.add_argument("--force", action="store_true", help="Invoke the workflow even if nothing changed")
+    parser.add_argument("--profile", default=None,
+                        help="Append per-stage timing spans (JSON lines) to this file, '-' for stderr "
+                             "(also $WARMING_STRIPES_PROFILE)")
+    args = parser.parse_args()
+    configure_profiling(args.profile)
+
+    if not os.path.exists(baseline_filename(args.job_file)):
+        print(f"Error: {baseline_filename(args.job_file)} not found; "
+              "prepare the job file with prepare_inputs_and_parameters.py first")
+        sys.exit(1)
+
+    gi = None
+    api_key = os.environ.get("GALAXY_API_KEY")
+    if api_key:
+        import bioblend.galaxy
+        gi = bioblend.galaxy.GalaxyInstance(url=args.galaxy_url, key=api_key)
+
+    try:
+        result = rerun(gi, args.workflow, args.job_file, args.output_dir, args.history_name, force=args.force)
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if result['status'] == 'ok':
+        print(f"✅ Invocation {result['invocation_id']} completed in {result['seconds']:.0f} s")
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Pipeline timing instrumentation
+Stages of the pipeline (nanopub fetch, DOI resolution, ROHub export, crate
+parsing, Galaxy upload, invocation wait, archive download, ...) run inside
+spans. When profiling is on, each span is written as one JSON line shaped
+like an OpenTelemetry span (trace/span/parent ids, start/end time in
+nanoseconds, status, attributes) with its wall time, the bytes it
+transferred and the peak RSS of the process. When it is off, spans cost
+one attribute lookup.
+
+Profiling is switched on with the --profile option of the scripts or with
+WARMING_STRIPES_PROFILE=<file.jsonl> ('-' writes to stderr); it is inherited
+by worker processes.
+"""
+
+import argparse
+import atexit
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILE_ENV = "WARMING_STRIPES_PROFILE"
+TRACE_ID_ENV = "WARMING_STRIPES_TRACE_ID"
+
+_lock = threading.Lock()
+# Innermost open span. A context variable rather than a thread-local, so each
+# asyncio task nests its own spans, and calls run through asyncio.to_thread
+# (which copies the context) get the span of the task as parent
+_current_span = contextvars.ContextVar('current_span', default=None)
+_sink = None
+_trace_id = None
+
+
+def peak_rss_bytes():
+    """Peak resident set size of the process so far, in bytes (None if unknown)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def configure(destination=None):
+    """
+    Switch profiling on.
+
+    Args:
+        destination: JSON lines file to append spans to, '-' for stderr
+                     (default: $WARMING_STRIPES_PROFILE; profiling stays off if unset)
+    """
+    global _sink, _trace_id
+    destination = destination or os.environ.get(PROFILE_ENV)
+    if not destination:
+        return
+    with _lock:
+        if _sink is not None and _sink is not sys.stderr:
+            _sink.close()
+        _sink = sys.stderr if destination == '-' else open(destination, 'a', buffering=1)
+        # Worker processes (also spawned ones) write to the same trace
+        _trace_id = os.environ.get(TRACE_ID_ENV) or os.urandom(16).hex()
+        os.environ[PROFILE_ENV] = destination
+        os.environ[TRACE_ID_ENV] = _trace_id
+
+
+def enabled():
+    return _sink is not None
+
+
+def _close():
+    global _sink
+    with _lock:
+        if _sink is not None and _sink is not sys.stderr:
+            _sink.close()
+        _sink = None
+
+
+atexit.register(_close)
+
+
+class Span:
+    """A timed pipeline stage; attributes end up in the emitted record."""
+
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent.span_id if parent else None
+        self.bytes = 0
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_bytes(self, count):
+        """Count bytes read, written or transferred by the stage."""
+        self.bytes += count
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def add_bytes(self, count):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time the enclosed block as a pipeline stage.
+
+    Spans nest per thread and per asyncio task. The yielded span takes extra attributes and
+    byte counts; exceptions are recorded and re-raised.
+    """
+    if _sink is None:
+        yield _NOOP_SPAN
+        return
+
+    current = Span(name, attributes, _current_span.get())
+    token = _current_span.set(current)
+    status = {'code': 'OK'}
+    start_ns = time.time_ns()
+    start = time.perf_counter_ns()
+    rss_before = peak_rss_bytes()
+    try:
+        yield current
+    except BaseException as e:
+        status = {'code': 'ERROR', 'message': f"{type(e).__name__}: {e}"}
+        raise
+    finally:
+        duration = time.perf_counter_ns() - start
+        _current_span.reset(token)
+        rss = peak_rss_bytes()
+        current.attributes.update({
+            'duration_ms': round(duration / 1e6, 3),
+            'bytes': current.bytes,
+            'process.pid': os.getpid(),
+            'process.peak_rss_bytes': rss,
+            'process.peak_rss_growth_bytes': rss - rss_before if rss is not None else None,
+        })
+        record = {
+            'name': name,
+            'trace_id': _trace_id,
+            'span_id': current.span_id,
+            'parent_span_id': current.parent_span_id,
+            'start_time_unix_nano': start_ns,
+            'end_time_unix_nano': start_ns + duration,
+            'status': status,
+            'attributes': current.attributes,
+        }
+        line = json.dumps(record, default=str) + "\n"
+        with _lock:
+            if _sink is not None:
+                _sink.write(line)
+
+
+def instrumented(name=None):
+    """Decorator running each call of a function in a span (named after the function by default)."""
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return function(*args, **kwargs)
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summarize(filename):
+    """
+    Aggregate a spans file per stage.
+
+    Returns:
+        dict: span name -> {'count', 'total_ms', 'max_ms', 'bytes', 'peak_rss_bytes'}
+    """
+    stages = {}
+    with open(filename) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            attributes = record['attributes']
+            stage = stages.setdefault(record['name'], {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                                       'bytes': 0, 'peak_rss_bytes': 0})
+            stage['count'] += 1
+            stage['total_ms'] += attributes['duration_ms']
+            stage['max_ms'] = max(stage['max_ms'], attributes['duration_ms'])
+            stage['bytes'] += attributes.get('bytes') or 0
+            stage['peak_rss_bytes'] = max(stage['peak_rss_bytes'], attributes.get('process.peak_rss_bytes') or 0)
+    return stages
+
+
+# Profiling requested through the environment
+configure()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a spans file per stage, slowest stages first",
+                                     epilog="Example: python instrumentation.py spans.jsonl")
+    parser.add_argument("spans", help="Spans file (JSON lines) written with --profile or $WARMING_STRIPES_PROFILE")
+    args = parser.parse_args()
+    print(f"{'stage':<32} {'count':>6} {'total s':>9} {'max s':>8} {'MB':>9} {'peak RSS MB':>12}")
+    for stage_name, stage in sorted(summarize(args.spans).items(), key=lambda item: -item[1]['total_ms']):
+        print(f"{stage_name:<32} {stage['count']:>6} {stage['total_ms'] / 1000:>9.2f} {stage['max_ms'] / 1000:>8.2f} "
+              f"{stage['bytes'] / 1e6:>9.1f} {stage['peak_rss_bytes'] / 1e6:>12.1f}")
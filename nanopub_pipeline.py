@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+End-to-end pipeline from executable nanopublications to rerun results
+Chains README steps 1 to 4 in one process for one or many nanopublications:
+fetch the nanopub, resolve its supporting DOIs, download the ROHub RO-Crates,
+prepare workflow.ga and the job file, then rerun the workflow on Galaxy and
+download the invocation's RO-Crate. The stages are driven by asyncio so that
+independent I/O overlaps: Galaxy and ROHub logins happen while the nanopubs
+are fetched, and inputs are uploaded while the workflow is imported. All
+nanopubs are processed concurrently; every blocking call (nanopub fetch,
+DOI resolution, crate export, crate preparation, upload, Galaxy API call)
+takes one slot of a global concurrency budget. A crate supporting several
+nanopubs is downloaded, prepared and run once.
+
+    python nanopub_pipeline.py https://w3id.org/np/RAnqaMx3Ri3bR8yY3oiM-BeMJf8LPxidTSqyEpcHyXoLc --galaxy_url https://usegalaxy.eu
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from download_cache import ROCrateCache
+from galaxy_rocrate_finder import fetch_nanopub, find_supporting_dois, resolve_doi
+from galaxy_runner import download_invocation_archive, poll_delays, poll_invocation
+from incremental_rerun import (diff_job, invoke_with_job_cache, is_unchanged, read_job, record_rerun,
+                               reuse_outputs, upload_inputs)
+from instrumentation import configure as configure_profiling
+from prepare_inputs_and_parameters import prepare_rocrate
+from ROHubROCrateSearcher import ROHubIDExtractor, ROHubROCrateSearcher
+from uri_cache import URICache
+
+# Default number of blocking calls (network transfers, Galaxy API calls, ...) in flight
+PIPELINE_CONCURRENCY = 8
+
+
+async def wait_for_invocation_async(pipeline, gi, invocation_id, timeout=3600, initial_interval=2,
+                                    max_interval=60, backoff=2, jitter=0.2):
+    """
+    Asynchronous galaxy_runner.wait_for_invocation: a concurrency slot is only held while polling.
+
+    Polls follow the same galaxy_runner.poll_delays schedule.
+
+    Returns:
+        dict: Final job state summary
+    """
+    scheduled = False
+    states = {}
+    for delay in poll_delays(timeout, initial_interval, max_interval, backoff, jitter):
+        await asyncio.sleep(delay)
+        scheduled, states, summary = await pipeline.blocking(poll_invocation, gi, invocation_id, scheduled)
+        if summary is not None:
+            return summary
+    raise TimeoutError(f"Invocation {invocation_id} not complete after {timeout} s (jobs: {states})")
+
+
+def connect_galaxy(galaxy_url, api_key):
+    """Open a Galaxy connection and check the API key (one request)."""
+    import bioblend.galaxy
+    gi = bioblend.galaxy.GalaxyInstance(url=galaxy_url, key=api_key)
+    user = gi.users.get_current_user()
+    print(f"✓ Authenticated to {galaxy_url} as {user.get('username') or user.get('email')}")
+    return gi
+
+
+class NanopubPipeline:
+    """
+    Runs nanopublications through the pipeline on one event loop.
+
+    Stages that block (library calls doing network or disk I/O) run in
+    worker threads, at most concurrency of them at a time.
+    """
+
+    def __init__(self, output_dir, galaxy_url=None, api_key=None, searcher=None, cache=None,
+                 rocrate_cache=None, concurrency=PIPELINE_CONCURRENCY, history_name='ScienceLive',
+                 timeout=6 * 3600, prepare_only=False, force=False):
+        """
+        Args:
+            output_dir: Root directory: crates are downloaded to crates/, each crate is
+                        prepared and rerun in a directory named after it
+            galaxy_url: Galaxy server the workflows are rerun on
+            api_key: Galaxy API key
+            searcher: ROHubROCrateSearcher used for every download
+            cache: Optional URICache for nanopubs and DOI resolutions
+            rocrate_cache: Optional ROCrateCache
+            concurrency: Maximum number of blocking calls in flight
+            history_name: Name of the history created for each rerun
+            timeout: Per-invocation timeout, in seconds
+            prepare_only: Stop after preparing the crates (Galaxy is not contacted)
+            force: Invoke the workflows even if their job files match their baselines
+        """
+        self.output_dir = output_dir
+        self.galaxy_url = galaxy_url
+        self.api_key = api_key
+        self.searcher = searcher or ROHubROCrateSearcher()
+        self.extractor = ROHubIDExtractor()
+        self.cache = cache
+        self.rocrate_cache = rocrate_cache
+        self.concurrency = max(1, concurrency)
+        self.history_name = history_name
+        self.timeout = timeout
+        self.prepare_only = prepare_only
+        self.force = force
+        self._budget = None
+        self._galaxy = None
+        self._crates = {}
+
+    async def blocking(self, function, *args, **kwargs):
+        """Run a blocking call in a worker thread within the concurrency budget."""
+        async with self._budget:
+            return await asyncio.to_thread(function, *args, **kwargs)
+
+    def galaxy(self):
+        """Galaxy connection, opened on first use (a task shared by all crates)."""
+        if self._galaxy is None:
+            if not self.api_key:
+                raise ValueError("GALAXY_API_KEY environment variable not set")
+            self._galaxy = asyncio.ensure_future(self.blocking(connect_galaxy, self.galaxy_url, self.api_key))
+        return self._galaxy
+
+    async def find_crates(self, nanopub_uri):
+        """ROHub research objects supporting a nanopub (through its cito:obtainsSupportFrom DOIs)."""
+        nanopub = await self.blocking(fetch_nanopub, nanopub_uri, self.cache)
+        if not nanopub:
+            raise RuntimeError(f"Failed to fetch nanopublication {nanopub_uri}")
+        dois = find_supporting_dois(nanopub)
+        if not dois:
+            raise RuntimeError(f"No supporting DOIs found in {nanopub_uri}")
+
+        resolutions = await asyncio.gather(*(self.blocking(resolve_doi, doi, cache=self.cache) for doi in dois))
+        rohub_ids = []
+        for resolution in resolutions:
+            if resolution['error'] or not resolution['url']:
+                print(f"✗ Failed to resolve DOI {resolution['doi']}: "
+                      f"{resolution['error'] or resolution['status_code']}")
+            elif 'rohub.org' in resolution['url']:
+                rohub_ids.append(self.extractor.extract_id(resolution['url']))
+        return list(dict.fromkeys(rohub_id for rohub_id in rohub_ids if rohub_id))
+
+    async def rerun(self, job_filename, workflow_filename, output_dir):
+        """
+        Rerun a prepared workflow on Galaxy and download the invocation RO-Crate.
+
+        A crate that was only prepared is always invoked. Once a rerun is
+        recorded in the baseline, a job file that still matches it is not
+        invoked again (unless force) and the outputs of that rerun are reused,
+        as with incremental_rerun.rerun.
+
+        Returns:
+            (invocation_id, archive); archive is None when the outputs were reused
+        """
+        job, baseline = await self.blocking(read_job, job_filename)
+        diff = await self.blocking(diff_job, job, baseline)
+        if baseline.get('invocation_id') and is_unchanged(diff) and not self.force:
+            print(f"✓ {job_filename} unchanged since invocation {baseline['invocation_id']}")
+            await self.blocking(reuse_outputs, baseline, output_dir)
+            return baseline.get('invocation_id'), None
+
+        gi = await self.galaxy()
+
+        async def upload():
+            history_id = (await self.blocking(gi.histories.create_history, name=self.history_name))["id"]
+            return history_id, await self.blocking(upload_inputs, gi, job, history_id)
+
+        # The workflow is imported while the inputs are uploaded
+        workflow, (history_id, inputs) = await asyncio.gather(
+            self.blocking(gi.workflows.import_workflow_from_local_path, workflow_filename), upload())
+        invocation = await self.blocking(invoke_with_job_cache, gi, workflow["id"], history_id, inputs)
+        print(f"⏳ Invocation {invocation['id']} of {workflow_filename} submitted")
+        await wait_for_invocation_async(self, gi, invocation['id'], timeout=self.timeout)
+
+        # Later edits of the job file are rerun incrementally against this invocation
+        await self.blocking(record_rerun, job_filename, job, baseline, diff, invocation['id'])
+
+        archive = os.path.join(output_dir, "rerun.rocrate.zip")
+        await self.blocking(download_invocation_archive, gi, invocation['id'], archive)
+        return invocation['id'], archive
+
+    async def _run_crate(self, rohub_id):
+        start = time.monotonic()
+        result = {'rohub_id': rohub_id, 'rocrate': None, 'output_dir': None, 'invocation_id': None,
+                  'archive': None, 'status': 'ok', 'error': None}
+        try:
+            offline = bool(self.cache and self.cache.offline)
+            rocrate_path = await self.blocking(self.searcher.download_rocrate, rohub_id,
+                                               os.path.join(self.output_dir, "crates"), self.rocrate_cache, offline)
+            if not rocrate_path:
+                raise RuntimeError(f"Could not download RO-Crate {rohub_id}")
+            result['rocrate'] = rocrate_path
+
+            output_dir = os.path.join(self.output_dir, rohub_id)
+            os.makedirs(output_dir, exist_ok=True)
+            job_filename = os.path.join(output_dir, "workflow_input_params.yml")
+            workflow_filename = os.path.join(output_dir, "workflow.ga")
+            await self.blocking(prepare_rocrate, rocrate_path, output_dir, job_filename, workflow_filename)
+            result['output_dir'] = output_dir
+
+            if not self.prepare_only:
+                result['invocation_id'], result['archive'] = await self.rerun(job_filename, workflow_filename,
+                                                                              output_dir)
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        result['seconds'] = round(time.monotonic() - start, 3)
+        mark = "✓" if result['status'] == 'ok' else "✗"
+        print(f"{mark} RO-Crate {rohub_id} ({result['seconds']:.0f} s){': ' + result['error'] if result['error'] else ''}")
+        return result
+
+    def run_crate(self, rohub_id):
+        """Download, prepare and rerun a crate once, however many nanopubs it supports."""
+        if rohub_id not in self._crates:
+            self._crates[rohub_id] = asyncio.ensure_future(self._run_crate(rohub_id))
+        return self._crates[rohub_id]
+
+    async def run_nanopub(self, nanopub_uri):
+        """
+        Run one nanopublication through the pipeline.
+
+        Returns:
+            dict with nanopub, status ('ok' or 'failed'), error and the results of its crates
+        """
+        result = {'nanopub': nanopub_uri, 'status': 'ok', 'error': None, 'crates': []}
+        try:
+            rohub_ids = await self.find_crates(nanopub_uri)
+            if not rohub_ids:
+                raise RuntimeError(f"No ROHub RO-Crate supports {nanopub_uri}")
+            result['crates'] = list(await asyncio.gather(*(self.run_crate(rohub_id) for rohub_id in rohub_ids)))
+            failures = [crate['rohub_id'] for crate in result['crates'] if crate['status'] != 'ok']
+            if failures:
+                raise RuntimeError(f"Failed RO-Crate(s): {', '.join(failures)}")
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        return result
+
+    async def run(self, nanopub_uris):
+        """Run all nanopublications concurrently; returns their results, in order."""
+        self._budget = asyncio.Semaphore(self.concurrency)
+        # Every blocking call holds a slot, so the budget is also the number of threads needed
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency))
+
+        # Logins overlap with fetching the nanopubs and exporting the crates
+        logins = []
+        if self.searcher.username and self.searcher.password:
+            logins.append(self.blocking(self.searcher.ensure_authenticated))
+        if not self.prepare_only and self.api_key:
+            logins.append(self.galaxy())
+        logins = [asyncio.ensure_future(login) for login in logins]
+
+        results = await asyncio.gather(*(self.run_nanopub(uri) for uri in nanopub_uris))
+        # Login errors are reported by the crates that needed the login
+        await asyncio.gather(*logins, return_exceptions=True)
+        return list(results)
+
+
+def _read_rohub_credentials():
+    home_dir = os.path.expanduser("~")
+    try:
+        with open(os.path.join(home_dir, "rohub-user")) as user, open(os.path.join(home_dir, "rohub-pwd")) as pwd:
+            return user.read().rstrip(), pwd.read().rstrip()
+    except OSError:
+        print("Note: no ~/rohub-user and ~/rohub-pwd, only public ROs will be accessible")
+        return None, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rerun the Galaxy workflows of executable nanopublications, end to end",
+        epilog="Example: python nanopub_pipeline.py https://w3id.org/np/RAnqaMx3Ri3bR8yY3oiM-BeMJf8LPxidTSqyEpcHyXoLc")
+    parser.add_argument("nanopub_uris", nargs="+", help="URIs of the nanopublications")
+    parser.add_argument("--output_dir", default="pipeline_runs",
+                        help="Root of the downloaded crates and per-crate output directories")
+    parser.add_argument("--galaxy_url", default="https://usegalaxy.eu/", help="Galaxy server")
+    parser.add_argument("--history_name", default="ScienceLive", help="Name of the history created for each rerun")
+    parser.add_argument("--concurrency", type=int, default=PIPELINE_CONCURRENCY,
+                        help=f"Maximum number of network/Galaxy calls in flight (default: {PIPELINE_CONCURRENCY})")
+    parser.add_argument("--prepare-only", action="store_true",
+                        help="Stop after preparing workflow.ga and the job files (Galaxy is not contacted)")
+    parser.add_argument("--force", action="store_true",
+                        help="Invoke the workflows even if nothing changed since their last rerun")
+    parser.add_argument("--cache", default=None,
+                        help="Nanopub/DOI cache file (default: $WARMING_STRIPES_CACHE or ~/.cache/warming-stripes/uri_cache.sqlite)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the nanopub/DOI/RO-Crate caches")
+    parser.add_argument("--rocrate-cache", default=None,
+                        help="RO-Crate download cache directory (default: $WARMING_STRIPES_ROCRATE_CACHE or ~/.cache/warming-stripes/rocrates)")
+    parser.add_argument("--offline", action="store_true", default=None,
+                        help="Only use cached nanopubs, DOI resolutions and RO-Crates (also $WARMING_STRIPES_OFFLINE=1)")
+    parser.add_argument("--profile", default=None,
+                        help="Append per-stage timing spans (JSON lines) to this file, '-' for stderr "
+                             "(also $WARMING_STRIPES_PROFILE)")
+    args = parser.parse_args()
+    if args.offline and args.no_cache:
+        parser.error("--offline needs the caches: it cannot be combined with --no-cache")
+    configure_profiling(args.profile)
+
+    api_key = os.environ.get("GALAXY_API_KEY")
+    if not api_key and not args.prepare_only:
+        print("Error: GALAXY_API_KEY environment variable not set (or use --prepare-only)")
+        sys.exit(1)
+
+    rohub_user, rohub_pwd = _read_rohub_credentials()
+    pipeline = NanopubPipeline(
+        args.output_dir, args.galaxy_url, api_key,
+        searcher=ROHubROCrateSearcher(username=rohub_user, password=rohub_pwd),
+        cache=None if args.no_cache else URICache(args.cache, offline=args.offline),
+        rocrate_cache=None if args.no_cache else ROCrateCache(args.rocrate_cache),
+        concurrency=args.concurrency, history_name=args.history_name, prepare_only=args.prepare_only,
+        force=args.force)
+
+    start = time.perf_counter()
+    results = asyncio.run(pipeline.run(args.nanopub_uris))
+    failures = [result for result in results if result['status'] != 'ok']
+
+    print("\n" + "=" * 60)
+    print("PIPELINE SUMMARY")
+    print("=" * 60)
+    print(f"Nanopublications: {len(results)}")
+    print(f"Succeeded: {len(results) - len(failures)}")
+    print(f"Failed: {len(failures)}")
+    for result in failures:
+        print(f"  • {result['nanopub']}: {result['error']}")
+    for result in results:
+        for crate in result['crates']:
+            if crate['archive']:
+                print(f"  ✅ {crate['rohub_id']}: invocation {crate['invocation_id']}, RO-Crate {crate['archive']}")
+            elif crate['status'] == 'ok' and not args.prepare_only:
+                print(f"  ✓ {crate['rohub_id']}: unchanged, outputs reused")
+    print(f"Wall time: {time.perf_counter() - start:.2f} s")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, "pipeline_summary.json"), 'w') as f:
+        json.dump({'wall_seconds': round(time.perf_counter() - start, 3), 'results': results}, f, indent=2)
+    sys.exit(1 if failures else 0)
@@ -1,133 +1,84 @@
 #!/usr/bin/env python3
 
-from rocrate.rocrate import ROCrate
+import argparse
+import contextlib
 import json
-import zipfile
-from pathlib import Path
-import sys
 import os
-import ast
+import sys
+import time
 import yaml
-import shutil
+from concurrent.futures import as_completed
+
+from galaxy_rocrate import (DATASET_KEYS, index_datasets, open_galaxy_crate,
+                            read_invocation, resolve_datasets)
+from incremental_rerun import baseline_filename, make_baseline, read_baseline, write_baseline
+from instrumentation import configure as configure_profiling, instrumented, span
+from streaming_json import stream_datasets
 
-# importing the zipfile module
-from zipfile import ZipFile
+# Crate files used to prepare a rerun; we only process the first match of each
+CRATE_FILE_PATTERNS = [".ga", "invocation_attrs.txt", "datasets_attrs.txt", "jobs_attrs.txt", ".yml"]
+# Galaxy format2 workflows also end with .yml, but are never the job file
+WORKFLOW_YML_SUFFIX = ".gxwf.yml"
 
-def find_files_os_walk(directory, type_of_file):
+
+def find_crate_files(crate):
     """
-    Find type_of_file files using os.walk()
-    
-    Args:
-        directory (str): Root directory to search
-        type_of_file (str): prefix to look for (e.g. ".ga")
-    
+    Find the crate files used to prepare a rerun in one walk of the crate.
+
     Returns:
-        list: List of full paths to type_of_file files
+        dict: CRATE_FILE_PATTERNS entry -> member names; the first one is used.
+        .gxwf.yml workflows are not listed as job files.
     """
-    find_files = []
-    
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(type_of_file):
-                full_path = os.path.join(root, file)
-                find_files.append(full_path)
-    
-    return find_files
+    found = crate.find_all(CRATE_FILE_PATTERNS, first_only=[pattern for pattern in CRATE_FILE_PATTERNS
+                                                            if pattern != ".yml"])
+    found[".yml"] = [name for name in found[".yml"] if not name.endswith(WORKFLOW_YML_SUFFIX)]
+    return found
+
 
-def get_datasets_info(filename, inputs_encoded_ids, outputs_encoded_ids):
-    # Parse datasets file for actual input files
-    inputs_names = []
-    outputs_names = []
+def get_datasets_info(fileobj, inputs_encoded_ids, outputs_encoded_ids):
+    # Parse datasets file (open binary file object) for actual input files
     try:
-        with open(filename) as f:
-            datasets = json.load(f)
-            for dataset in datasets:
-                for encoded_id in inputs_encoded_ids:
-                    if dataset["encoded_id"] == encoded_id["dataset_id"]:
-                        inputs_names.append(dataset["file_name"])
-                for encoded_id in outputs_encoded_ids:
-                    if dataset["encoded_id"] == encoded_id["dataset_id"]:
-                        outputs_names.append(dataset["file_name"])
-            return inputs_names, outputs_names
+        wanted_ids = {ref['dataset_id'] for ref in inputs_encoded_ids + outputs_encoded_ids}
+        dataset_index = index_datasets(stream_datasets(fileobj, keys=DATASET_KEYS), wanted_ids)
+
+        inputs, missing_inputs = resolve_datasets(dataset_index, inputs_encoded_ids)
+        outputs, missing_outputs = resolve_datasets(dataset_index, outputs_encoded_ids)
+        for ref in missing_inputs:
+            print(f"Warning: no dataset found for input {ref['dataset_id']} (order {ref['order']})")
+        for ref in missing_outputs:
+            print(f"Warning: no dataset found for output {ref['dataset_id']} (order {ref['order']})")
+
+        inputs_names = [ref['file_name'] for ref in inputs]
+        outputs_names = [ref['file_name'] for ref in outputs]
+        return inputs_names, outputs_names
     except Exception as e:
         print(f"Error reading dataset data: {e}")
+        return [], []
                     
-def get_invocation_info(filename):
-    # Parse invocation file for actual execution parameters
+def get_invocation_info(fileobj):
+    # Parse invocation file (open binary file object) for actual execution parameters
     try:
-        with open(filename) as f:
-            invocation_data = json.load(f)[0]
+        invocation = read_invocation(fileobj)
                 
-        print(f"Execution Status: {invocation_data.get('state')}")
-        print(f"Executed: {invocation_data.get('create_time')}")
-
-        workflow_parameters = []
-        # Extract workflow input parameters
-        for input_parameter in invocation_data.get('input_parameters', []): 
-            if "WorkflowRequestInputParameter" in input_parameter.values():
-                if input_parameter["value"] != "false":
-                  workflow_parameters.append( ast.literal_eval(input_parameter["value"]))
-
-        # Extract actual parameters used
-        actual_params = {}
-        for step_state in invocation_data.get('step_states', []):
-            step_value = step_state.get('value', {})
-            step_index = step_state.get('order_index')
-            
-            for param_name, param_value in step_value.items(): 
-                if not param_name.startswith('__') and param_name not in ['chromInfo', 'dbkey']:
-                    # Clean parameter values
-                    if isinstance(param_value, str) and param_value.startswith('"') and param_value.endswith('"'):
-                        param_value = param_value[1:-1]
-                    elif isinstance(param_value, str) and param_value.startswith('{'):
-                        try:
-                            param_value = json.loads(param_value)
-                        except:
-                            pass 
-
-                    actual_params[param_name] = param_value
-
-        # Get input/output dataset info
-        input_datasets = []
-        for inp_ds in invocation_data.get('input_datasets', []):
-            dataset_id = inp_ds.get('dataset', {}).get('encoded_id')
-            input_datasets.append({
-                'dataset_id': dataset_id,
-                'order': inp_ds.get('order_index', 0)
-            })
-
-        output_datasets = []
-        for out_ds in invocation_data.get('output_datasets', []):
-            dataset_id = out_ds.get('dataset', {}).get('encoded_id')
-            label = out_ds.get('workflow_output', {}).get('label')
-            output_datasets.append({
-                'dataset_id': dataset_id,
-                'label': label,
-                'order': out_ds.get('order_index', 0)
-            })
-
-        #print(actual_params)
-        #print(input_datasets)
-        #print(output_datasets)
-        return input_datasets, actual_params, workflow_parameters, output_datasets
+        print(f"Execution Status: {invocation['state']}")
+        print(f"Executed: {invocation['create_time']}")
+
+        return (invocation['input_datasets'], invocation['actual_parameters'],
+                invocation['workflow_parameters'], invocation['output_datasets'])
     except Exception as e:
         print(f"Error reading invocation data: {e}")
-        actual_params = {}
-        input_datasets = []
-        output_datasets = []
-        workflow_parameters = []
+        return [], {}, [], []
 
-def prepare_jobfile(ifilenames, ofilenames, workflow, jobfile, odir, 
+def prepare_jobfile(crate, ifilenames, ofilenames, workflow, jobfile, odir,
                               rjob_filename, rworkflow_filename):
     try:
         print(workflow)
-        shutil.copy(workflow, rworkflow_filename)
+        with open(rworkflow_filename, 'wb') as f:
+            f.write(crate.read(workflow))
         print(f"Workflow copied successfully in {rworkflow_filename}")
         
-        # Set input filenames
-        ifilenames_with_odir = []
-        for ifilename in ifilenames:
-            ifilenames_with_odir.append(odir + "/" + ifilename)
+        ifilenames = list(ifilenames)
+        referenced_inputs = []
         
         # Set output filenames
         ofilenames_with_odir = []
@@ -135,72 +86,249 @@ def prepare_jobfile(ifilenames, ofilenames, workflow, jobfile, odir,
             ofilenames_with_odir.append(odir + "/" + ofilename)
 
         # Read jobfile (yml)
-        with open(jobfile, 'r') as f:
-            data_jobfile = yaml.load(f, Loader=yaml.SafeLoader)[0] # Assume one element in the returned list
-
-            job_section = data_jobfile.get('job', {})
-            output_section = data_jobfile.get('outputs', {})
-            print("Reading job section")
-            for key, value in job_section.items():
-                if isinstance(value, dict) and 'path' in value:
-                    # You could add extra checks here, e.g., value['class'] == 'File'
-                    print(f"Updating path under key: {key} and value: {value}")
-                    if value["class"] == "File":
-                        value["path"] = ifilenames_with_odir.pop(0)
-                else:
-                    print("Parameter: ", key)
-
-            for key, value in output_section.items():
-                if isinstance(value, dict) and 'path' in value:
-                    print(f"Updating path under key: {key} and value: {value}")
-                    value["path"] = ofilenames_with_odir.pop(0)
-            
-            with open(rjob_filename, 'w') as f:
-                yaml.dump(job_section, f, sort_keys=False)
+        data_jobfile = yaml.load(crate.read(jobfile), Loader=yaml.SafeLoader)[0] # Assume one element in the returned list
+
+        job_section = data_jobfile.get('job', {})
+        output_section = data_jobfile.get('outputs', {})
+        print("Reading job section")
+        for key, value in job_section.items():
+            if isinstance(value, dict) and 'path' in value:
+                # You could add extra checks here, e.g., value['class'] == 'File'
+                print(f"Updating path under key: {key} and value: {value}")
+                if value["class"] == "File":
+                    ifilename = ifilenames.pop(0)
+                    referenced_inputs.append(ifilename)
+                    value["path"] = odir + "/" + ifilename
+            else:
+                print("Parameter: ", key)
+
+        for key, value in output_section.items():
+            if isinstance(value, dict) and 'path' in value:
+                print(f"Updating path under key: {key} and value: {value}")
+                value["path"] = ofilenames_with_odir.pop(0)
+
+        # Only the datasets referenced by the job file are written to disk
+        with span("crate.extract", datasets=len(referenced_inputs)) as stage:
+            for path in crate.extract(referenced_inputs, odir):
+                stage.add_bytes(os.path.getsize(path))
+                print(f"Extracted input dataset: {path}")
+        
+        with span("jobfile.write"), open(rjob_filename, 'w') as f:
+            yaml.dump(job_section, f, sort_keys=False)
+        return True
             
     except Exception as e:
         print(f"Error writing job file: {e}")
+        return False
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python prepare_inputs_and_parameters.py <rocrate.zip> <output_dir>")
-        print("Example: python prepare_inputs_and_parameters.py downloaded_rocrate/d5430aa5-7a8b-44fe-8d21-6a7c80ac36d4.zip downloaded_workflows")
-        sys.exit(1)
-    
-    rocrate_path = sys.argv[1]
-    output_dir = sys.argv[2]
-    
-    try:
-        workflows = []
-        invocations = []
-        datasets = []
-        jobfiles = []
-        # unloading the *.zip and creating a zip object
-        with ZipFile(rocrate_path, 'r') as zObject:
-        # Extracting all the members of the zip 
-        # into a specific location.
-            zObject.extractall(output_dir)
-        
-            workflows = find_files_os_walk(output_dir, ".ga")
-            invocations = find_files_os_walk(output_dir, "invocation_attrs.txt")
-            datasets = find_files_os_walk(output_dir, "datasets_attrs.txt")
-            jobparams = find_files_os_walk(output_dir, "jobs_attrs.txt")
-            jobfiles = find_files_os_walk(output_dir, ".yml")
+@instrumented("prepare.rocrate")
+def prepare_rocrate(rocrate_path, output_dir, rjob_filename="workflow_input_params.yml",
+                    rworkflow_filename="workflow.ga"):
+    """
+    Prepare the workflow and job file needed to rerun a Galaxy RO-Crate.
+
+    Args:
+        rocrate_path: RO-Crate ZIP file or extracted crate directory
+        output_dir: Directory receiving the input datasets referenced by the job file
+        rjob_filename: Job file (yml) to write
+        rworkflow_filename: Copy of the Galaxy workflow (.ga) to write
+
+    Raises:
+        RuntimeError: if the crate lacks a required file or the job file cannot be written
+    """
+    # Index the ZIP (or walk the extracted crate) once; metadata members are
+    # read without extracting anything
+    with open_galaxy_crate(rocrate_path) as crate:
+        found = find_crate_files(crate)
+        missing = [pattern for pattern in CRATE_FILE_PATTERNS if not found[pattern]]
+        if missing:
+            raise RuntimeError(f"No {', '.join(missing)} file found in {rocrate_path}")
+        workflows = found[".ga"]
+        invocations = found["invocation_attrs.txt"]
+        datasets = found["datasets_attrs.txt"]
+        jobparams = found["jobs_attrs.txt"]
+        jobfiles = found[".yml"]
 
         print("Extracting information from invocation attribute file")
         # we assume one single invocation file. If more, we process the first one only.
-        input_datasets, actual_params, workflow_params, output_datasets = get_invocation_info(invocations[0])
+        with span("invocation.parse") as stage, crate.open(invocations[0]) as f:
+            stage.add_bytes(crate.size(invocations[0]))
+            input_datasets, actual_params, workflow_params, output_datasets = get_invocation_info(f)
 
         print("Extracting information from dataset attribute file")
         # We assume one single datasets_attrs.txt file
-        input_filenames, output_filenames = get_datasets_info(datasets[0], input_datasets, output_datasets)
+        with span("datasets.parse") as stage, crate.open(datasets[0]) as f:
+            stage.add_bytes(crate.size(datasets[0]))
+            input_filenames, output_filenames = get_datasets_info(f, input_datasets, output_datasets)
 
         print("Extracting information from job attribute file")    
         # We assume one single jobfile.      
-        prepare_jobfile(input_filenames, output_filenames, workflows[0], jobfiles[0], output_dir, 
-                              "workflow_input_params.yml", "workflow.ga")
-        
+        if not prepare_jobfile(crate, input_filenames, output_filenames, workflows[0], jobfiles[0], output_dir, 
+                               rjob_filename, rworkflow_filename):
+            raise RuntimeError(f"Could not write job file {rjob_filename}")
+
+    # Record what the source invocation ran with, for incremental reruns. A
+    # baseline recording a rerun of the same crate is kept: the next rerun is
+    # diffed against that invocation rather than against the crate
+    baseline_path = baseline_filename(rjob_filename)
+    previous = read_baseline(baseline_path) if os.path.exists(baseline_path) else {}
+    if previous.get('invocation_id') and previous.get('rocrate') == os.path.abspath(rocrate_path):
+        print(f"Rerun baseline of invocation {previous['invocation_id']} kept in {baseline_path}")
+        return
+    with span("baseline.write"):
+        with open(rjob_filename) as f:
+            job = yaml.safe_load(f)
+        write_baseline(baseline_path, make_baseline(job, rocrate_path, actual_params, output_filenames))
+    print(f"Rerun baseline written in {baseline_path}")
+
+
+def find_rocrates(source):
+    """
+    List the RO-Crates to prepare in batch mode.
+
+    Args:
+        source: Directory holding *.zip crates and/or extracted crate directories,
+                or a manifest file with one crate path per line ('#' starts a comment)
+
+    Returns:
+        list: Crate paths
+    """
+    if os.path.isdir(source):
+        rocrates = []
+        with os.scandir(source) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                if entry.is_file() and entry.name.endswith(".zip"):
+                    rocrates.append(entry.path)
+                elif entry.is_dir() and os.path.exists(os.path.join(entry.path, "ro-crate-metadata.json")):
+                    rocrates.append(entry.path)
+        return rocrates
+
+    # Manifest: relative paths are relative to the manifest location
+    base_dir = os.path.dirname(source)
+    rocrates = []
+    with open(source) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                rocrates.append(os.path.join(base_dir, line))
+    return rocrates
+
+
+def _crate_namespaces(rocrates, output_root):
+    """Give each crate its own output directory, named after the crate."""
+    namespaces = []
+    used = set()
+    for rocrate_path in rocrates:
+        name = os.path.basename(os.path.normpath(rocrate_path))
+        if name.endswith(".zip"):
+            name = name[:-len(".zip")]
+        unique_name = name
+        suffix = 1
+        while unique_name in used:
+            suffix += 1
+            unique_name = f"{name}-{suffix}"
+        used.add(unique_name)
+        namespaces.append(os.path.join(output_root, unique_name))
+    return namespaces
+
+
+def _prepare_batch_item(rocrate_path, output_dir):
+    """Prepare one crate in a worker process, logging its output to prepare.log."""
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    result = {'rocrate': rocrate_path, 'output_dir': output_dir, 'status': 'ok', 'error': None}
+    with open(os.path.join(output_dir, "prepare.log"), 'w') as log, contextlib.redirect_stdout(log):
+        try:
+            prepare_rocrate(rocrate_path, output_dir,
+                            os.path.join(output_dir, "workflow_input_params.yml"),
+                            os.path.join(output_dir, "workflow.ga"))
+        except Exception as e:
+            print(f"Error: {e}")
+            result['status'] = 'failed'
+            result['error'] = str(e)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def prepare_batch(rocrates, output_root, workers=None):
+    """
+    Prepare many RO-Crates across a process pool.
+
+    Each crate gets its own directory below output_root holding its
+    workflow.ga, workflow_input_params.yml, input datasets and prepare.log.
+    A summary is printed and written to output_root/batch_summary.json.
+
+    Args:
+        rocrates: List of crate paths (see find_rocrates)
+        output_root: Root directory for the per-crate outputs
+        workers: Number of worker processes (default: number of CPUs)
+
+    Returns:
+        list: One result dict per crate with status, error and seconds
+    """
+    # Imported here: multiprocessing is only needed in batch mode
+    from concurrent.futures import ProcessPoolExecutor
+
+    start = time.perf_counter()
+    namespaces = _crate_namespaces(rocrates, output_root)
+    results = [None] * len(rocrates)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_prepare_batch_item, rocrate_path, output_dir): position
+                   for position, (rocrate_path, output_dir) in enumerate(zip(rocrates, namespaces))}
+        for future in as_completed(futures):
+            result = future.result()
+            mark = "✓" if result['status'] == 'ok' else "✗"
+            print(f"{mark} {result['rocrate']} ({result['seconds']:.2f} s)")
+            results[futures[future]] = result
+
+    failures = [result for result in results if result['status'] != 'ok']
+    elapsed = time.perf_counter() - start
+    item_seconds = sum(result['seconds'] for result in results)
+
+    print("\n" + "=" * 60)
+    print("BATCH SUMMARY")
+    print("=" * 60)
+    print(f"Crates: {len(results)}")
+    print(f"Succeeded: {len(results) - len(failures)}")
+    print(f"Failed: {len(failures)}")
+    for result in failures:
+        print(f"  • {result['rocrate']}: {result['error']}")
+    print(f"Wall time: {elapsed:.2f} s (sum of per-crate times: {item_seconds:.2f} s)")
+
+    os.makedirs(output_root, exist_ok=True)
+    with open(os.path.join(output_root, "batch_summary.json"), 'w') as f:
+        json.dump({'wall_seconds': round(elapsed, 3), 'results': results}, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prepare workflow.ga and workflow_input_params.yml to rerun a Galaxy RO-Crate",
+        epilog="Example: python prepare_inputs_and_parameters.py downloaded_rocrate/d5430aa5-7a8b-44fe-8d21-6a7c80ac36d4.zip downloaded_workflows")
+    parser.add_argument("rocrate", help="<rocrate.zip|extracted_rocrate_dir>, or with --batch a directory of crates or a manifest file")
+    parser.add_argument("output_dir", help="Output directory (with --batch, root of the per-crate output directories)")
+    parser.add_argument("--batch", action="store_true", help="Prepare many crates across a process pool")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes in batch mode")
+    parser.add_argument("--profile", default=None,
+                        help="Append per-stage timing spans (JSON lines) to this file, '-' for stderr "
+                             "(also $WARMING_STRIPES_PROFILE)")
+    args = parser.parse_args()
+    configure_profiling(args.profile)
+    
+    rocrate_path = args.rocrate
+    output_dir = args.output_dir
+
+    if args.batch:
+        rocrates = find_rocrates(rocrate_path)
+        if not rocrates:
+            print(f"Error: no RO-Crate found in {rocrate_path}")
+            sys.exit(1)
+        results = prepare_batch(rocrates, output_dir, args.workers)
+        sys.exit(1 if any(result['status'] != 'ok' for result in results) else 0)
+    
+    try:
+        prepare_rocrate(rocrate_path, output_dir)
     except FileNotFoundError:
         print(f"Error: {rocrate_path} not found")
         print("Make sure climate.rocrate.zip is in the current directory")
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Incremental JSON reader for large Galaxy export files
+Streams records out of invocation_attrs.txt, datasets_attrs.txt and
+jobs_attrs.txt without loading the whole document, so memory stays flat
+regardless of the export size. Works on regular files and ZIP members alike.
+
+Locations inside the document are given as ijson-style prefixes: dotted object
+keys, with "item" standing for every element of an array. For example
+"item.steps.item" is every step of every invocation in invocation_attrs.txt.
+"""
+
+import codecs
+import json
+import re
+
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_CHARS = '0123456789.eE+-'
+# Returned by JSONStream.decode_buffered for values that go beyond the buffered data
+_INCOMPLETE = object()
+
+
+class JSONStream:
+    """Pull parser over a binary or text file object holding a JSON document."""
+
+    def __init__(self, fileobj, chunk_size: int = CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.bytes_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read(self, size: int = None) -> bool:
+        """Append the next chunk to the buffer; return False at end of file."""
+        if self.eof:
+            return False
+        chunk = self.fileobj.read(size or self.chunk_size)
+        final = not chunk
+        if isinstance(chunk, bytes):
+            chunk = self.bytes_decoder.decode(chunk, final=final)
+        if final:
+            self.eof = True
+        # Drop what has already been consumed before growing the buffer
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        self.buf += chunk
+        return not final or bool(chunk)
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it ('' at EOF)."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read():
+                return ''
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' but found '{found or 'end of file'}'")
+        self.pos += 1
+
+    def decode(self):
+        """Decode and consume the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                # Grow geometrically so a large value is not re-parsed per chunk
+                self._read(max(self.chunk_size, len(self.buf) - self.pos))
+                continue
+            if not self.eof and (end == len(self.buf) or self.buf[end] in _NUMBER_CHARS):
+                # A number may continue in the next chunk
+                self._read()
+                continue
+            self.pos = end
+            return value
+
+    def decode_buffered(self):
+        """
+        Decode and consume the next value if it ends within the buffered data.
+
+        The buffer is topped up to at least one chunk first, so memory stays
+        bounded by two chunks. Larger values are left unconsumed. Call peek()
+        first: the value must start at the current position.
+
+        Returns:
+            The value, or _INCOMPLETE
+        """
+        if len(self.buf) - self.pos < self.chunk_size:
+            self._read()
+        try:
+            value, end = self.decoder.raw_decode(self.buf, self.pos)
+        except json.JSONDecodeError:
+            if self.eof:
+                raise
+            return _INCOMPLETE
+        if not self.eof and (end == len(self.buf) or self.buf[end] in _NUMBER_CHARS):
+            return _INCOMPLETE
+        self.pos = end
+        return value
+
+    def skip(self):
+        """
+        Consume the next JSON value without keeping it.
+
+        Scalars, and containers that end within the buffered data, are decoded
+        in C and dropped. Larger containers are walked instead, skipping their
+        elements the same way, and the text is discarded as it goes.
+        """
+        char = self.peek()
+        if char not in '{[':
+            self.decode()
+            return
+        if self.decode_buffered() is not _INCOMPLETE:
+            return
+        # Too large for the buffer: skip it element by element, so only one
+        # element (or, if it is large too, one of its own elements) is held at a time
+        if char == '[':
+            for _ in self.iter_array():
+                self.skip()
+        else:
+            for _ in self.iter_object():
+                self.skip()
+
+    def iter_array(self):
+        """Yield once per array element; the caller must consume each element."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or ']' but found '{char or 'end of file'}'")
+
+    def iter_object(self):
+        """Yield each member key; the caller must consume the member value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f"Expected ',' or '}}' but found '{char or 'end of file'}'")
+
+    def walk(self, parts, leaf):
+        """Descend along prefix parts and yield from leaf() at every match."""
+        if not parts:
+            yield from leaf()
+            return
+        head, rest = parts[0], parts[1:]
+        if head == 'item':
+            if self.peek() != '[':
+                self.skip()
+                return
+            for _ in self.iter_array():
+                yield from self.walk(rest, leaf)
+        else:
+            if self.peek() != '{':
+                self.skip()
+                return
+            for key in self.iter_object():
+                if key == head:
+                    yield from self.walk(rest, leaf)
+                else:
+                    self.skip()
+
+
+def _prefix_parts(prefix: str):
+    return tuple(part for part in prefix.split('.') if part)
+
+
+def iter_json_items(fileobj, prefix: str = 'item', chunk_size: int = CHUNK_SIZE):
+    """
+    Stream the JSON values found at prefix.
+
+    Args:
+        fileobj: Binary or text file object (e.g. from ZipFile.open)
+        prefix: ijson-style location, 'item' = each element of the top-level array
+        chunk_size: Number of bytes read from fileobj at a time
+
+    Yields:
+        Each matching value, fully decoded
+    """
+    stream = JSONStream(fileobj, chunk_size)
+
+    def leaf():
+        yield stream.decode()
+
+    yield from stream.walk(_prefix_parts(prefix), leaf)
+
+
+def iter_json_objects(fileobj, prefix: str = 'item', keys=None, chunk_size: int = CHUNK_SIZE):
+    """
+    Stream the objects found at prefix, keeping only the selected members.
+
+    Only one record is held in memory at a time.
+
+    Args:
+        fileobj: Binary or text file object (e.g. from ZipFile.open)
+        prefix: ijson-style location of the objects
+        keys: Member names to keep; in records larger than the buffer, other
+              members are skipped unparsed. None keeps every member.
+        chunk_size: Number of bytes read from fileobj at a time
+
+    Yields:
+        dict of the selected members of each matching object
+    """
+    stream = JSONStream(fileobj, chunk_size)
+    wanted = set(keys) if keys is not None else None
+
+    def leaf():
+        if stream.peek() != '{':
+            yield stream.decode()
+            return
+        # Records that end within the buffered data are decoded in one C call
+        # and filtered afterwards; larger ones (e.g. a whole invocation) are
+        # walked member by member so unwanted members are skipped unparsed
+        record = stream.decode_buffered()
+        if record is not _INCOMPLETE:
+            if wanted is not None:
+                record = {key: value for key, value in record.items() if key in wanted}
+            yield record
+            return
+        selected = {}
+        for key in stream.iter_object():
+            if wanted is None or key in wanted:
+                selected[key] = stream.decode()
+            else:
+                stream.skip()
+        yield selected
+
+    yield from stream.walk(_prefix_parts(prefix), leaf)
+
+
+def stream_datasets(fileobj, keys=None):
+    """Yield the dataset records of a datasets_attrs.txt file one at a time."""
+    return iter_json_objects(fileobj, 'item', keys=keys)
+
+
+def stream_jobs(fileobj, keys=None):
+    """Yield the job records of a jobs_attrs.txt file one at a time."""
+    return iter_json_objects(fileobj, 'item', keys=keys)
+
+
+def stream_invocation_steps(fileobj, keys=None):
+    """Yield the steps of every invocation in an invocation_attrs.txt file."""
+    return iter_json_objects(fileobj, 'item.steps.item', keys=keys)
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Local warming stripes renderer
+Renders the stripes of the Galaxy climate stripes workflow without Galaxy,
+from the same workflow_input_params.yml produced by
+prepare_inputs_and_parameters.py. Values are mapped to colours with one
+vectorized colormap lookup and written straight into an image array (one
+pixel column per stripe slice, no patch per year). In batch mode the stripes
+of every station of a network are rendered across a process pool.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import yaml
+
+from instrumentation import configure as configure_profiling, span
+from table_reader import read_columns, to_float_array
+
+# Keys of workflow_input_params.yml (Galaxy climate stripes workflow inputs)
+INPUT_FILE_KEY = "files.tabular"
+COLUMN_KEY = "Column name to use for plotting"
+TITLE_KEY = "Plot Title"
+NXSPLIT_KEY = "nxsplit"
+XNAME_KEY = "xname (column name for the x-axis)"
+DATE_FORMAT_KEY = "Date/time format for the x-axis column"
+LABEL_FORMAT_KEY = "dates format for xlabels"
+COLORMAP_KEY = "Matplotlib colormap"
+
+DEFAULT_COLORMAP = "RdBu_r"
+DEFAULT_WIDTH = 1200
+DEFAULT_HEIGHT = 400
+
+# Station tables picked up from a --batch directory
+TABLE_EXTENSIONS = (".csv", ".tabular", ".tsv", ".txt")
+
+
+def stripes_params(job):
+    """Extract the renderer settings from a loaded workflow_input_params.yml."""
+    input_file = job.get(INPUT_FILE_KEY) or {}
+    return {
+        'path': input_file.get('path'),
+        'filetype': input_file.get('filetype'),
+        'column': job.get(COLUMN_KEY),
+        'title': job.get(TITLE_KEY),
+        'nxsplit': job.get(NXSPLIT_KEY),
+        'xname': job.get(XNAME_KEY),
+        'date_format': job.get(DATE_FORMAT_KEY),
+        'label_format': job.get(LABEL_FORMAT_KEY),
+        'colormap': job.get(COLORMAP_KEY) or DEFAULT_COLORMAP,
+    }
+
+
+def stripe_colors(values, colormap=DEFAULT_COLORMAP):
+    """
+    Map values to RGB colours in one vectorized lookup.
+
+    Values are normalised between their minimum and maximum; NaN gives white.
+
+    Returns:
+        uint8 array of shape (len(values), 3)
+    """
+    import numpy as np
+    import matplotlib
+
+    values = np.asarray(values, dtype=float)
+    vmin, vmax = np.nanmin(values), np.nanmax(values)
+    scale = (vmax - vmin) or 1.0
+    normalised = (values - vmin) / scale
+    colors = matplotlib.colormaps[colormap](normalised, bytes=True)[:, :3]
+    colors[np.isnan(values)] = 255
+    return colors
+
+
+def stripes_image(values, colormap=DEFAULT_COLORMAP, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT):
+    """
+    Build the stripes as an image array.
+
+    Each pixel column takes the colour of the stripe it falls in, so the
+    image is filled with a single fancy-indexing operation.
+
+    Returns:
+        uint8 array of shape (height, width, 3)
+    """
+    import numpy as np
+
+    colors = stripe_colors(values, colormap)
+    stripe_of_column = np.arange(width) * len(colors) // width
+    return np.broadcast_to(colors[stripe_of_column], (height, width, 3))
+
+
+def xtick_labels(xvalues, nxsplit=None, date_format=None, label_format=None):
+    """
+    Positions (stripe indices) and labels of the x-axis ticks.
+
+    Args:
+        xvalues: Raw values of the x-axis column
+        nxsplit: Number of ticks (default: about 10)
+        date_format: strptime format of xvalues (None: use them as they are)
+        label_format: strftime format of the labels when date_format is set
+    """
+    import numpy as np
+
+    nticks = int(nxsplit) if nxsplit else min(10, len(xvalues))
+    if not nticks:
+        return [], []
+    positions = np.linspace(0, len(xvalues) - 1, nticks).round().astype(int)
+    labels = []
+    for position in positions:
+        label = xvalues[position]
+        if date_format:
+            label = datetime.strptime(label, date_format).strftime(label_format or date_format)
+        labels.append(label)
+    return positions, labels
+
+
+# (width, height) -> matplotlib figure, per process
+_FIGURES = {}
+
+
+def render_stripes(values, output, colormap=DEFAULT_COLORMAP, title=None, xticks=None,
+                   width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT):
+    """
+    Write the stripes of values to output (PNG).
+
+    Without title and ticks the image array is written directly; otherwise the
+    stripes are drawn as a single image in a figure carrying the title and labels.
+
+    Args:
+        values: Values to plot, one stripe each
+        output: Output file
+        colormap: Matplotlib colormap name
+        title: Plot title
+        xticks: (positions, labels) from xtick_labels
+        width, height: Size of the stripes in pixels
+    """
+    import numpy as np
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.image
+    import matplotlib.pyplot as plt
+
+    if not title and not xticks:
+        matplotlib.image.imsave(output, np.ascontiguousarray(stripes_image(values, colormap, width, height)))
+        return output
+
+    # Figures are reused between renders of the same size (setting one up
+    # costs more than drawing the stripes)
+    dpi = 100
+    fig = _FIGURES.get((width, height))
+    if fig is None:
+        # Margins of 40 px around the stripes for the edge tick labels, 80 px below, 40 px above for the title
+        fig = plt.figure(figsize=((width + 80) / dpi, (height + 120) / dpi), dpi=dpi)
+        fig.add_axes([40 / (width + 80), 80 / (height + 120), width / (width + 80), height / (height + 120)])
+        _FIGURES[(width, height)] = fig
+    ax = fig.axes[0]
+    ax.clear()
+    # One image row with one pixel per stripe, stretched over the axes
+    ax.imshow(stripe_colors(values, colormap)[np.newaxis], aspect='auto', interpolation='nearest',
+              extent=(-0.5, len(values) - 0.5, 0, 1))
+    ax.set_yticks([])
+    if xticks:
+        positions, labels = xticks
+        ax.set_xticks(positions)
+        ax.set_xticklabels(labels)
+    else:
+        ax.set_xticks([])
+    if title:
+        ax.set_title(title)
+    fig.savefig(output, dpi=dpi)
+    return output
+
+
+def _render_params(data, output, params, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, cache=None):
+    """
+    Render stripes from settings as returned by stripes_params.
+
+    Args:
+        data: Column name -> raw values, or the path of a CSV/tabular file to read them from
+        output: Output PNG file
+        params: Settings (title and xname None for bare stripes)
+        width, height: Size of the stripes in pixels
+        cache: column_cache.ColumnCache to read the file through (None: parse it)
+    """
+    if isinstance(data, str):
+        columns = [params['column']]
+        if params['xname']:
+            columns.append(params['xname'])
+        with span("stripes.read", path=data, cached=cache is not None) as stage:
+            if cache is not None:
+                data = cache.load(data, columns, params['filetype'], numeric=[params['column']])
+            else:
+                stage.add_bytes(os.path.getsize(data))
+                data = read_columns(data, columns, params['filetype'])
+    values = to_float_array(data[params['column']])
+
+    xticks = None
+    if params['xname']:
+        xticks = xtick_labels(data[params['xname']], params['nxsplit'],
+                              params['date_format'], params['label_format'])
+    with span("stripes.render", output=output):
+        return render_stripes(values, output, params['colormap'], params['title'], xticks, width, height)
+
+
+def _without_axes(params):
+    return dict(params, title=None, xname=None)
+
+
+def render_from_job_file(job_filename, output, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, axes=True,
+                         cache=None):
+    """
+    Render the stripes described by a workflow_input_params.yml job file.
+
+    With a column_cache.ColumnCache, the input is parsed on the first render
+    only; later renders memory-map the plotted and x-axis columns.
+    """
+    with open(job_filename) as f:
+        params = stripes_params(yaml.safe_load(f))
+    if not params['path'] or not params['column']:
+        raise ValueError(f"{job_filename} must set '{INPUT_FILE_KEY}' and '{COLUMN_KEY}'")
+    if not axes:
+        params = _without_axes(params)
+    return _render_params(params['path'], output, params, width, height, cache)
+
+
+def find_station_tables(source):
+    """
+    List the per-station tables of a directory.
+
+    Returns:
+        dict: station name (file name without extension) -> path, sorted by name
+    """
+    tables = {}
+    with os.scandir(source) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            name, extension = os.path.splitext(entry.name)
+            if entry.is_file() and extension.lower() in TABLE_EXTENSIONS:
+                tables[name] = entry.path
+    return tables
+
+
+def group_by_station(path, station_column, columns, filetype=None, cache=None, numeric=()):
+    """
+    Read a long-format table once and split it by station.
+
+    Only station_column and columns are kept; rows keep their file order
+    within each station.
+
+    Args:
+        cache: column_cache.ColumnCache to read the table through (None: parse it)
+        numeric: Columns to convert to floats (read through the cache only)
+
+    Returns:
+        dict: station -> {column: numpy array of the values}
+    """
+    import numpy as np
+
+    if cache is not None:
+        data = cache.load(path, [station_column] + list(columns), filetype, numeric=numeric)
+    else:
+        data = read_columns(path, [station_column] + list(columns), filetype)
+    names, inverse = np.unique(np.asarray(data[station_column]), return_inverse=True)
+    rows = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(names)))[:-1]
+    arrays = {column: np.asarray(data[column]) for column in columns}
+    return {str(name): {column: array[station_rows] for column, array in arrays.items()}
+            for name, station_rows in zip(names, np.split(rows, bounds))}
+
+
+def _station_outputs(stations, output_dir):
+    """One PNG per station, with file names made safe and unique."""
+    outputs = []
+    used = set()
+    for station in stations:
+        name = re.sub(r'[^\w.-]+', '_', station).strip('._') or "station"
+        unique_name = name
+        suffix = 1
+        while unique_name in used:
+            suffix += 1
+            unique_name = f"{name}-{suffix}"
+        used.add(unique_name)
+        outputs.append(os.path.join(output_dir, f"{unique_name}.png"))
+    return outputs
+
+
+def _render_batch_item(task):
+    """Render the stripes of one station in a worker process."""
+    station, data, output, params, width, height, cache = task
+    start = time.perf_counter()
+    result = {'station': station, 'output': output, 'status': 'ok', 'error': None}
+    if params['title']:
+        params = dict(params, title=params['title'].replace('{station}', station))
+    try:
+        _render_params(data, output, params, width, height, cache)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    result['milliseconds'] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def render_batch(source, output_dir, params, station_column=None, workers=None,
+                 width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, cache=None):
+    """
+    Render the stripes of many stations across a process pool.
+
+    source is either a directory with one CSV/tabular file per station, each
+    read by the worker rendering it, or a single long-format table with a
+    station column, read once here and split by station. Only the plotted
+    and x-axis columns are parsed. '{station}' in the title is replaced by
+    the station name. A summary is printed and written to
+    output_dir/batch_summary.json.
+
+    Args:
+        source: Directory of station tables, or long-format table
+        output_dir: Directory for the <station>.png files
+        params: Settings as returned by stripes_params (its input path is ignored)
+        station_column: Station column of a long-format table
+        workers: Number of worker processes (default: number of CPUs)
+        width, height: Size of the stripes in pixels
+        cache: column_cache.ColumnCache to read the tables through (None: parse them)
+
+    Returns:
+        list: One result dict per station with status, error and milliseconds
+    """
+    start = time.perf_counter()
+    # The file type of the job's own input says nothing about the station tables
+    params = dict(params, filetype=None)
+    if os.path.isdir(source):
+        stations = find_station_tables(source)
+    else:
+        if not station_column:
+            raise ValueError("A station column is needed to render a long-format table")
+        columns = [params['column']] + ([params['xname']] if params['xname'] else [])
+        stations = group_by_station(source, station_column, columns, params['filetype'], cache,
+                                    numeric=[params['column']])
+    read_seconds = time.perf_counter() - start
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = _station_outputs(stations, output_dir)
+    tasks = [(station, data, output, params, width, height, cache)
+             for (station, data), output in zip(stations.items(), outputs)]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = []
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Stations take milliseconds each: hand them out in chunks to amortize the IPC
+        chunksize = max(1, len(tasks) // (workers * 8))
+        for result in executor.map(_render_batch_item, tasks, chunksize=chunksize):
+            if result['status'] != 'ok':
+                print(f"✗ {result['station']}: {result['error']}")
+            results.append(result)
+
+    failures = [result for result in results if result['status'] != 'ok']
+    elapsed = time.perf_counter() - start
+    milliseconds = sorted(result['milliseconds'] for result in results)
+
+    print("\n" + "=" * 60)
+    print("BATCH SUMMARY")
+    print("=" * 60)
+    print(f"Stations: {len(results)}")
+    print(f"Succeeded: {len(results) - len(failures)}")
+    print(f"Failed: {len(failures)}")
+    if milliseconds:
+        print(f"Per station: median {milliseconds[len(milliseconds) // 2]:.1f} ms, max {milliseconds[-1]:.1f} ms")
+    print(f"Wall time: {elapsed:.2f} s (reading: {read_seconds:.2f} s, "
+          f"{len(results) / max(elapsed, 1e-6):.0f} stations/s with {workers} workers)")
+
+    with open(os.path.join(output_dir, "batch_summary.json"), 'w') as f:
+        json.dump({'wall_seconds': round(elapsed, 3), 'read_seconds': round(read_seconds, 3),
+                   'workers': workers, 'results': results}, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render warming stripes locally from a workflow_input_params.yml job file",
+        epilog="Example: python stripes_renderer.py workflow_input_params.yml stripes.png")
+    parser.add_argument("job_file", help="Job file written by prepare_inputs_and_parameters.py "
+                                         "(with --batch, only its plotting parameters are used)")
+    parser.add_argument("output", help="Output PNG file (with --batch, output directory)")
+    parser.add_argument("--width", type=int, default=DEFAULT_WIDTH, help="Width of the stripes in pixels")
+    parser.add_argument("--height", type=int, default=DEFAULT_HEIGHT, help="Height of the stripes in pixels")
+    parser.add_argument("--no-axes", action="store_true", help="Write the bare stripes, without title and labels")
+    parser.add_argument("--batch", metavar="SOURCE",
+                        help="Render every station of SOURCE: a directory of station CSV/tabular files, "
+                             "or one long-format table (with --station-column)")
+    parser.add_argument("--station-column", help="Station column of a long-format --batch table")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes in batch mode")
+    parser.add_argument("--column-cache", default=None,
+                        help="Directory of the columnar cache of the input tables "
+                             "(default: $WARMING_STRIPES_COLUMN_CACHE or ~/.cache/warming-stripes/columns)")
+    parser.add_argument("--no-column-cache", action="store_true", help="Parse the input tables on every run")
+    parser.add_argument("--profile", default=None,
+                        help="Append per-stage timing spans (JSON lines) to this file, '-' for stderr "
+                             "(also $WARMING_STRIPES_PROFILE)")
+    args = parser.parse_args()
+    configure_profiling(args.profile)
+
+    cache = None
+    if not args.no_column_cache:
+        from column_cache import ColumnCache
+        cache = ColumnCache(args.column_cache)
+
+    if args.batch:
+        with open(args.job_file) as f:
+            params = stripes_params(yaml.safe_load(f))
+        if not params['column']:
+            print(f"Error: {args.job_file} must set '{COLUMN_KEY}'")
+            sys.exit(1)
+        if args.no_axes:
+            params = _without_axes(params)
+        try:
+            results = render_batch(args.batch, args.output, params, args.station_column, args.workers,
+                                   args.width, args.height, cache)
+        except Exception as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        sys.exit(1 if any(result['status'] != 'ok' for result in results) else 0)
+
+    try:
+        render_from_job_file(args.job_file, args.output, args.width, args.height, axes=not args.no_axes,
+                             cache=cache)
+        print(f"✅ Stripes saved to: {args.output}")
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Column reader for the CSV/tabular inputs of the stripes workflow
+Reads only the columns asked for, and converts raw values to floats. Shared
+by stripes_renderer.py and column_cache.py.
+"""
+
+import csv
+
+
+def _delimiter(header_line, filetype=None):
+    if filetype == 'tabular' or (filetype != 'csv' and '\t' in header_line):
+        return '\t'
+    return ','
+
+
+def guess_filetype(path, filetype=None):
+    """Resolve a filetype of None to 'csv' or 'tabular', the way read_columns guesses it."""
+    if filetype is not None:
+        return filetype
+    with open(path, newline='') as f:
+        return 'tabular' if _delimiter(f.readline()) == '\t' else 'csv'
+
+
+def read_columns(path, columns, filetype=None):
+    """
+    Read only the given columns of a CSV/tabular file.
+
+    Args:
+        path: Input file
+        columns: Column names to keep (None: all of them)
+        filetype: 'csv' or 'tabular'; guessed from the header when None
+
+    Returns:
+        dict: column name -> list of the raw (string) values
+    """
+    with open(path, newline='') as f:
+        header_line = f.readline()
+        delimiter = _delimiter(header_line, filetype)
+        header = next(csv.reader([header_line], delimiter=delimiter))
+        header = [name.strip() for name in header]
+        if columns is None:
+            columns = header
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise KeyError(f"Column(s) {missing} not found in {path} (columns: {header})")
+        indices = [header.index(column) for column in columns]
+        values = {column: [] for column in columns}
+        for row in csv.reader(f, delimiter=delimiter):
+            if not row:
+                continue
+            for column, index in zip(columns, indices):
+                values[column].append(row[index].strip() if index < len(row) else '')
+    return values
+
+
+def to_float_array(raw_values):
+    """Convert raw strings to a float array; empty or invalid entries become NaN."""
+    import numpy as np
+
+    try:
+        return np.asarray(raw_values, dtype=float)
+    except ValueError:
+        pass
+    values = np.empty(len(raw_values), dtype=float)
+    for i, raw in enumerate(raw_values):
+        try:
+            values[i] = float(raw)
+        except ValueError:
+            values[i] = np.nan
+    return values
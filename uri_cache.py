@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Persistent on-disk cache for network lookups keyed by URI
+Nanopublications are content-addressed by their trusty URI and are cached
+without expiry; DOI resolutions are cached with a TTL. Entries are stored in
+a single SQLite file and the least recently used ones are evicted once the
+cache grows beyond its size limit. In offline mode callers must not touch the
+network and only use what is cached.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "warming-stripes", "uri_cache.sqlite")
+DEFAULT_MAX_ENTRIES = 10000
+
+# Time-to-live of a cached DOI resolution, in seconds
+DOI_TTL = 7 * 24 * 3600
+
+
+class OfflineCacheMiss(Exception):
+    """Raised when a URI is needed in offline mode but is not cached."""
+
+
+class URICache:
+    """SQLite-backed key/value cache, namespaced by kind of lookup (e.g. 'nanopub', 'doi')."""
+
+    def __init__(self, path: str = None, offline: bool = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            path: SQLite file (default: $WARMING_STRIPES_CACHE or ~/.cache/warming-stripes/uri_cache.sqlite)
+            offline: Never go to the network (default: $WARMING_STRIPES_OFFLINE is set to 1/true/yes)
+            max_entries: Number of entries kept before least recently used ones are evicted
+        """
+        self.path = path or os.environ.get("WARMING_STRIPES_CACHE", DEFAULT_CACHE_PATH)
+        if offline is None:
+            offline = os.environ.get("WARMING_STRIPES_OFFLINE", "").lower() in ("1", "true", "yes")
+        self.offline = offline
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value BLOB NOT NULL,"
+                " created REAL NOT NULL,"
+                " accessed REAL NOT NULL,"
+                " expires REAL,"
+                " PRIMARY KEY (namespace, key))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        """Return the cached value, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT value, expires FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires < now:
+                self._db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                return None
+            self._db.execute("UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?",
+                             (now, namespace, key))
+            return value
+
+    def set(self, namespace: str, key: str, value, ttl: float = None):
+        """Store value (str or bytes); ttl=None keeps it until evicted."""
+        now = time.time()
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        expires = now + ttl if ttl is not None else None
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, created, accessed, expires)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, value, now, now, expires))
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones beyond max_entries."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+            if self.max_entries is not None:
+                self._db.execute(
+                    "DELETE FROM entries WHERE rowid IN ("
+                    " SELECT rowid FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,))
+
+    def clear(self, namespace: str = None):
+        with self._lock, self._db:
+            if namespace is None:
+                self._db.execute("DELETE FROM entries")
+            else:
+                self._db.execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+    def close(self):
+        self._db.close()
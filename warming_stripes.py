@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Single command line entry point for the warming stripes pipeline
+Each subcommand runs one of the scripts of this repository with its own
+options (`python warming_stripes.py prepare --help`). Only the script of the
+chosen subcommand is imported, and the scripts import their heavy
+dependencies (rdflib, nanopub, rohub, bioblend, matplotlib, ...) in the
+functions that need them, so short invocations (--help, usage errors, cached
+runs) start fast. The import-times subcommand measures this.
+
+    python warming_stripes.py find https://w3id.org/np/RAnqaMx3Ri3bR8yY3oiM-BeMJf8LPxidTSqyEpcHyXoLc downloaded_rocrate
+    python warming_stripes.py import-times
+"""
+
+import argparse
+import json
+import os
+import runpy
+import subprocess
+import sys
+import time
+
+# Subcommand -> (module, description)
+COMMANDS = {
+    'find': ('galaxy_rocrate_finder', "Find and download the Galaxy RO-Crates supporting a nanopublication"),
+    'prepare': ('prepare_inputs_and_parameters', "Prepare workflow.ga and the job file to rerun a crate"),
+    'markdown': ('extract_md_from_galaxy_rocrate', "Write the rerun information of a crate as markdown"),
+    'rerun': ('incremental_rerun', "Rerun a prepared workflow, executing only what changed"),
+    'sweep': ('galaxy_runner', "Run a Galaxy workflow for many parameter sets"),
+    'pipeline': ('nanopub_pipeline', "Run nanopublications end to end, from nanopub to rerun results"),
+    'stripes': ('stripes_renderer', "Render warming stripes locally from a job file"),
+    'catalog': ('crate_catalog', "Index crates in a SQLite catalog and query their runs"),
+    'benchmark': ('benchmark_crates', "Benchmark RO-Crate parsing on synthetic crates"),
+    'profile': ('instrumentation', "Summarize a spans file written with --profile"),
+}
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_command(command, arguments):
+    """Run the script of a subcommand as if it was started directly (python <script>.py arguments)."""
+    module, _ = COMMANDS[command]
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    sys.argv = [command, *arguments]
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+
+def _import_time(module, python=sys.executable):
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        (cumulative import time in seconds, {direct import: seconds}), or
+        (None, error) if the module cannot be imported
+    """
+    process = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"], cwd=REPO_DIR,
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        return None, process.stderr.strip().splitlines()[-1]
+    total = None
+    imports = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() == module:
+            total = int(cumulative) / 1e6
+        elif depth == 1:
+            imports[name.strip()] = int(cumulative) / 1e6
+    return total, imports
+
+
+def _startup_time(module, python=sys.executable):
+    """Wall time of `python <module>.py --help` (interpreter start included), in seconds."""
+    start = time.perf_counter()
+    subprocess.run([python, os.path.join(REPO_DIR, module + ".py"), "--help"], cwd=REPO_DIR,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def import_times(commands=None, repeats=5):
+    """
+    Measure how long the script of each subcommand takes to import and to print its --help.
+
+    Each measurement runs in a fresh interpreter; the best of repeats runs is kept.
+
+    Args:
+        commands: Subcommands to measure (default: all)
+        repeats: Runs per measurement
+
+    Returns:
+        list of dicts with command, module, import_s, help_s, heaviest
+        (the 3 slowest direct imports) and error
+    """
+    results = []
+    for command in commands or COMMANDS:
+        module, _ = COMMANDS[command]
+        result = {'command': command, 'module': module, 'import_s': None, 'help_s': None,
+                  'heaviest': {}, 'error': None}
+        runs = [_import_time(module) for _ in range(repeats)]
+        if runs[0][0] is None:
+            result['error'] = runs[0][1]
+        else:
+            best_total, best_imports = min(runs, key=lambda run: run[0])
+            result['import_s'] = round(best_total, 4)
+            heaviest = sorted(best_imports.items(), key=lambda item: -item[1])[:3]
+            result['heaviest'] = {name: round(seconds, 4) for name, seconds in heaviest}
+            result['help_s'] = round(min(_startup_time(module) for _ in range(repeats)), 4)
+        results.append(result)
+    return results
+
+
+def _command_list():
+    width = max(len(command) for command in [*COMMANDS, 'import-times'])
+    lines = [f"  {command:<{width}}  {description}" for command, (_, description) in COMMANDS.items()]
+    lines.append(f"  {'import-times':<{width}}  Measure the import and --help time of each subcommand")
+    return "commands:\n" + "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Warming stripes pipeline: rerun the Galaxy workflows of executable nanopublications",
+        epilog=_command_list() + "\n\nRun 'python warming_stripes.py <command> --help' for the options of a command.",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=[*COMMANDS, 'import-times'], metavar="command",
+                        help="One of the commands below")
+    parser.add_argument("arguments", nargs=argparse.REMAINDER, help="Arguments of the command")
+    args = parser.parse_args(argv)
+
+    if args.command != 'import-times':
+        run_command(args.command, args.arguments)
+        return
+
+    times_parser = argparse.ArgumentParser(
+        prog="warming_stripes.py import-times",
+        description="Measure the import and --help time of each subcommand, each in a fresh interpreter")
+    times_parser.add_argument("commands", nargs="*", metavar="command", help="Commands to measure (default: all)")
+    times_parser.add_argument("--repeats", type=int, default=5, help="Runs per measurement (the best is kept)")
+    times_parser.add_argument("--results", default=None, help="JSON lines file the results are appended to")
+    times_args = times_parser.parse_args(args.arguments)
+    unknown = [command for command in times_args.commands if command not in COMMANDS]
+    if unknown:
+        times_parser.error(f"unknown command(s): {', '.join(unknown)} (choose from {', '.join(COMMANDS)})")
+
+    results = import_times(times_args.commands, times_args.repeats)
+    print(f"{'command':<10} {'module':<32} {'import ms':>10} {'--help ms':>10}  heaviest imports")
+    for result in results:
+        if result['error']:
+            print(f"{result['command']:<10} {result['module']:<32} {'-':>10} {'-':>10}  ✗ {result['error']}")
+            continue
+        heaviest = ", ".join(f"{name} {seconds * 1000:.0f}" for name, seconds in result['heaviest'].items())
+        print(f"{result['command']:<10} {result['module']:<32} {result['import_s'] * 1000:>10.1f} "
+              f"{result['help_s'] * 1000:>10.1f}  {heaviest}")
+
+    if times_args.results:
+        with open(times_args.results, 'a') as f:
+            for result in results:
+                f.write(json.dumps({'time': time.time(), 'python': sys.version.split()[0], **result}) + "\n")
+    sys.exit(1 if any(result['error'] for result in results) else 0)
+
+
+if __name__ == "__main__":
+    main()